@@ -0,0 +1,81 @@
+"""
+
+Decoded audio cache.
+Every audio stage (transcription, alignment, diarization, speaker splitting) works on 16kHz mono float32 samples,
+the same `whisperx.load_audio` produces. Instead of each of them running ffmpeg over the whole video again, the
+samples are decoded once per source (content hash) into `cache/audio/<hash>.npy` and opened memory-mapped, so every
+caller gets a read-only, zero-copy view and only the pages it touches are read from disk.
+
+"""
+import os, fcntl, subprocess, tempfile
+import numpy as np
+from utils import log, format_duration, content_hash
+from utils import DIR_CACHE
+from tracing import tracer
+
+SAMPLE_RATE = 16000
+DIR_AUDIO_CACHE = f"{DIR_CACHE}/audio"
+# a 3h episode is ~700MB of samples, the least recently used ones go first
+MAX_AUDIO_CACHE_BYTES = 8 * 1024 ** 3
+# samples converted from int16 per step, bounds the memory used while decoding
+DECODE_BLOCK = SAMPLE_RATE * 60 * 10
+
+
+def audio_cache_path(src_path: str) -> str:
+    return f"{DIR_AUDIO_CACHE}/{content_hash(src_path)}.npy"
+
+
+def load_audio(src_path: str) -> np.ndarray:
+    """16kHz mono float32 samples of `src_path` in [-1, 1), memory-mapped read-only. Decodes on the first call."""
+    path = audio_cache_path(src_path)
+    if not os.path.exists(path):
+        os.makedirs(DIR_AUDIO_CACHE, exist_ok=True)
+        # a file lock, so processes loading the same source at once (eg. transcription and diarization) decode it once
+        with open(f"{path}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(path):
+                decode_audio(src_path, path)
+    else:
+        # keeps recently used entries at the end of the eviction order
+        os.utime(path)
+    return np.load(path, mmap_mode='r')
+
+
+def decode_audio(src_path: str, path: str) -> None:
+    """ffmpeg decodes to raw int16 on disk, which is converted block by block into the .npy, then renamed into place."""
+    os.makedirs(DIR_AUDIO_CACHE, exist_ok=True)
+    with tracer.span("decode_audio", video=src_path) as span, tempfile.TemporaryDirectory(dir=DIR_AUDIO_CACHE) as tmp:
+        raw = f"{tmp}/audio.s16le"
+        # same decoding as `whisperx.load_audio`
+        cmd = ["ffmpeg", "-nostdin", "-threads", "0", "-i", src_path, "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-y", raw]
+        try:
+            subprocess.run(cmd, capture_output=True, check=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Failed to load audio: {e.stderr.decode(errors='replace')}") from e
+
+        pcm = np.memmap(raw, dtype=np.int16, mode='r') if os.path.getsize(raw) else np.zeros(0, dtype=np.int16)
+        out = np.lib.format.open_memmap(f"{tmp}/audio.npy", mode='w+', dtype=np.float32, shape=(len(pcm),))
+        for start in range(0, len(pcm), DECODE_BLOCK):
+            np.divide(pcm[start:start + DECODE_BLOCK], 32768.0, out=out[start:start + DECODE_BLOCK], dtype=np.float32)
+        out.flush()
+        del out, pcm
+        os.replace(f"{tmp}/audio.npy", path)
+        tracer.count("audio_decoded_sec", os.path.getsize(path) / 4 / SAMPLE_RATE)
+    log(f"[+] audio_cache: Decoded '{src_path}' once in {format_duration(span.elapsed)}")
+    evict_audio_cache()
+
+
+def evict_audio_cache(max_bytes=MAX_AUDIO_CACHE_BYTES) -> None:
+    entries = sorted(
+        (os.path.join(DIR_AUDIO_CACHE, name) for name in os.listdir(DIR_AUDIO_CACHE) if name.endswith(".npy")),
+        key=os.path.getmtime,
+    )
+    total = sum(os.path.getsize(p) for p in entries)
+    for p in entries[:-1]:
+        if total <= max_bytes:
+            break
+        total -= os.path.getsize(p)
+        os.remove(p)
+        if os.path.exists(f"{p}.lock"):
+            os.remove(f"{p}.lock")
+        log(f"[i] audio_cache: Evicted '{p}'")
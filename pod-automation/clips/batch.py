@@ -0,0 +1,118 @@
+"""
+
+Batch mode: run the clips pipeline over many episodes.
+Stages are scheduled on dedicated workers, so episode N+1 is transcribing while episode N is being queried and cut:
+- transcription: a single CPU worker (whisper already uses all cores)
+- LLM querying: a shared I/O pool of `LLM_MAX_PARALLEL` requests (relevance filtering batches its own)
+- ffmpeg cutting: a shared pool of `CUT_MAX_PARALLEL` cuts for the parallel / single pass engine of `cut_and_save_clips`
+
+Usage: python batch.py <directory | manifest.txt | manifest.json>
+A manifest lists one video path per line (txt) or a JSON list of paths, relative paths are resolved from the manifest.
+
+"""
+import os, sys, json
+from pathlib import Path
+from time import time
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from utils import log, log_context, slugify, boot_ollama, save_cache, format_duration, content_hash
+from utils import DIR_OUTPUT, LLM_OPTIONS, LLM_MAX_PARALLEL
+from utils import MODEL_NAME, USE_CACHED_TRANSCRIPTION, USE_CACHED_LLM_OUTPUT, USE_SMART_CUT
+from utils import List, PostQueryResults
+
+from fn_chuck import chunk_by_tokens, token_budget
+from fn_query import query_clip_trailer_fulltext, query_chunks
+from fn_save_clips import cut_and_save_clips, output_text, CUT_MAX_PARALLEL
+from fn_transcribe import transcribe_with_whisperx
+from fn_post_processing import post_dedup_overlapping_clips, post_clean_obvious_clips, post_query_filter_relevant_clip
+from fn_keyframes import load_keyframe_index
+from tracing import tracer, format_usage
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".mkv", ".m4v")
+
+
+def load_episodes(source: str) -> List[str]:
+    path = Path(source)
+    if path.is_dir():
+        return sorted(str(p) for p in path.iterdir() if p.suffix.lower() in VIDEO_EXTENSIONS)
+    with open(path) as f:
+        entries = json.load(f) if path.suffix == ".json" else [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return [str((path.parent / entry).resolve()) for entry in entries]
+
+
+def episode_key(video_path: str) -> str:
+    """
+    Name of an episode's transcript and keyframe caches and output dir. Episodes in different folders can share a
+    file name, and slugified names can collide (eg. "Pod #1" and "Pod 1"), the content hash keeps them apart.
+    """
+    return f"{slugify(Path(video_path).stem, '')}-{content_hash(video_path)[:8]}"
+
+
+def process_episode(video_path: str, key: str, transcribing: Future, query_pool: ThreadPoolExecutor, cut_pool: ThreadPoolExecutor) -> dict:
+    guest_name = Path(video_path).stem or "Unknown Guest"
+    output_dir = f"{DIR_OUTPUT}/{key}"
+    os.makedirs(output_dir, exist_ok=True)
+    clip_file_name = slugify(f"{MODEL_NAME}_{guest_name}", '')
+
+    with log_context(episode=guest_name), tracer.span("episode", guest=guest_name) as episode:
+        transcription = transcribing.result()
+        started = time()
+        chunks = list(chunk_by_tokens(transcription['segments'], token_budget(MODEL_NAME)))
+        log(f"[+] batch: '{guest_name}' querying {len(chunks)} chucks")
+        all_results: PostQueryResults = []
+        for results in query_chunks(query_clip_trailer_fulltext, chunks, MODEL_NAME, LLM_OPTIONS['best_b'], USE_CACHED_LLM_OUTPUT, 3, pool=query_pool):
+            all_results.extend(results)
+        save_cache(f"{output_dir}/all_results.json", all_results)
+
+        post_results = post_dedup_overlapping_clips(all_results)
+        post_results = post_clean_obvious_clips(post_results)
+        post_results = post_query_filter_relevant_clip(post_results)
+
+        output_text(post_results, slugify(MODEL_NAME, ''), output_dir)
+        keyframes = load_keyframe_index(video_path, key) if USE_SMART_CUT else None
+        cut_and_save_clips(post_results, video_path, clip_file_name, output_dir, keyframes=keyframes, pool=cut_pool)
+        usage = format_usage(tracer.totals(episode))
+        log(f"[v] batch: '{guest_name}' done, {len(post_results)} clips in {output_dir}")
+        return {"episode": guest_name, "clips": len(post_results), "query_and_cut_sec": round(time() - started, 1), "llm": usage}
+
+
+def run_batch(episodes: List[str]) -> List[dict]:
+    summaries = []
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="transcribe") as transcribe_pool, \
+         ThreadPoolExecutor(max_workers=LLM_MAX_PARALLEL, thread_name_prefix="llm") as query_pool, \
+         ThreadPoolExecutor(max_workers=CUT_MAX_PARALLEL, thread_name_prefix="cut") as cut_pool, \
+         ThreadPoolExecutor(max_workers=max(1, len(episodes)), thread_name_prefix="episode") as episode_pool:
+        # transcriptions are queued in order on the single CPU worker, each episode continues as soon as its own is done
+        keys = [episode_key(path) for path in episodes]
+        episode_runs = [
+            episode_pool.submit(process_episode, path, key, transcribe_pool.submit(transcribe_with_whisperx, path, key, USE_CACHED_TRANSCRIPTION), query_pool, cut_pool)
+            for path, key in zip(episodes, keys)
+        ]
+        for path, run in zip(episodes, episode_runs):
+            try:
+                summaries.append(run.result())
+            except Exception as e:
+                log(f"[ERR] batch: '{path}' failed ({e})")
+    return summaries
+
+
+def main(source: str):
+    episodes = load_episodes(source)
+    assert episodes, f"No episodes found in: {source}"
+    boot_ollama()
+    log('', 2)
+    log(f"Start batch of {len(episodes)} episodes, Model='{MODEL_NAME}'")
+    started = time()
+    summaries = run_batch(episodes)
+    elapsed = time() - started
+
+    for summary in summaries:
+        log(f"    {summary['episode']}: {summary['clips']} clips, query+cut {summary['query_and_cut_sec']}sec, LLM {summary['llm']}")
+    tracer.export_chrome_trace(f"{DIR_OUTPUT}/trace_batch.json")
+    log(tracer.summary())
+    log(f"[v] Finished batch: {len(summaries)}/{len(episodes)} episodes in {format_duration(elapsed)} ({len(summaries) / (elapsed / 3600):.2f} episodes/hour)")
+
+
+if __name__ == "__main__":
+    assert len(sys.argv) > 1, "Usage: python batch.py <directory | manifest>"
+    main(sys.argv[1])
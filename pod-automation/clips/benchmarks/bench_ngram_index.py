@@ -0,0 +1,65 @@
+"""
+
+Micro-benchmark: highlight-to-transcript mapping, linear rescan vs `NgramIndex`.
+Usage: python benchmarks/bench_ngram_index.py [minutes] [highlights]
+
+"""
+import sys, json
+from time import perf_counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from fn_parsers import NgramIndex
+from benchmarks.synthetic import make_transcript, pick_highlights
+
+
+def map_by_rescan(words, highlights, n=8):
+    """The previous `fuzzy_parse_fullTexts` mapping: rebuild every n-gram string for every highlight."""
+    cleaned = [w.lower() for w in words]
+    spans = []
+    for text in highlights:
+        fuzzy_words = text.split()
+        start_snippet = " ".join(fuzzy_words[:n]).lower()
+        end_snippet = " ".join(fuzzy_words[-n:]).lower()
+        start_idx, end_idx = None, None
+        for i in range(len(cleaned) - n + 1):
+            words_slice = " ".join(cleaned[i:i+n])
+            if start_idx is None and words_slice == start_snippet:
+                start_idx = i
+                continue
+            if start_idx is not None and words_slice == end_snippet:
+                end_idx = i + n
+                break
+        spans.append((start_idx, end_idx) if end_idx else None)
+    return spans
+
+
+def main(minutes=180, count=36):
+    transcript = make_transcript(minutes)
+    words = [w["word"] for w in transcript["word_segments"]]
+    highlights = pick_highlights(transcript["word_segments"], count)
+
+    t0 = perf_counter()
+    expected = map_by_rescan(words, highlights)
+    t_rescan = perf_counter() - t0
+
+    t0 = perf_counter()
+    index = NgramIndex(words)
+    t_build = perf_counter() - t0
+    t0 = perf_counter()
+    spans = [index.find_span(text.split()) for text in highlights]
+    t_lookup = perf_counter() - t0
+
+    assert spans == expected, "NgramIndex spans differ from the rescan"
+    print(json.dumps({
+        "words": len(words),
+        "highlights": count,
+        "rescan_sec": round(t_rescan, 4),
+        "index_build_sec": round(t_build, 4),
+        "index_lookup_sec": round(t_lookup, 6),
+        "speedup": round(t_rescan / (t_build + t_lookup), 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:3]])
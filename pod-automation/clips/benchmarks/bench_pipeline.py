@@ -0,0 +1,205 @@
+"""
+
+Benchmark: the post-transcription stages and the pipeline as a whole, on synthetic transcripts.
+Runs offline: the LLM is a `ReplayTransport` answering with `llm_synthetic`, the LLM cache and logs go to a temporary directory and clips aren't cut.
+Every transcript length runs in a fresh subprocess, per stage it reports
+- `sec`: wall time of a plain run
+- `alloc_peak_kb` / `alloc_net_kb`: tracemalloc peak and retained allocations of a second, traced run
+- `rss_peak_kb`: peak RSS growth during the plain run (VmHWM, reset per stage through /proc/self/clear_refs, Linux only)
+and, under `startup`, a summary of `python -X importtime -c "import main"`: what a cached run pays before doing anything.
+
+Usage: python benchmarks/bench_pipeline.py [--minutes 30 60 180 360] [--latency 0] [--tokens-per-sec 0] [--output results.json]
+
+"""
+import os, sys, json, shutil, argparse, tempfile, subprocess, tracemalloc, platform
+from time import perf_counter
+from itertools import count
+from pathlib import Path
+
+DIR_CLIPS = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(DIR_CLIPS))
+
+MODEL_NAME = "llama3"
+DEFAULT_MINUTES = [30, 60, 180, 360]
+# should only ever be imported on the code paths that use them
+HEAVY_MODULES = ("whisperx", "torch", "ollama")
+STARTUP_BUDGET_SEC = 1.0
+
+
+def _rss_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        return int(next(line for line in f if line.startswith(field)).split()[1])
+
+
+def _reset_peak_rss() -> bool:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure(fn, *args) -> tuple:
+    """Run `fn` twice, once plain for time and RSS, once under tracemalloc for allocations."""
+    base_rss = _rss_kb("VmRSS") if _reset_peak_rss() else _rss_kb("VmHWM")
+    started = perf_counter()
+    result = fn(*args)
+    elapsed = perf_counter() - started
+    rss_peak = _rss_kb("VmHWM") - base_rss
+    del result
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "sec": round(elapsed, 4),
+        "alloc_peak_kb": round((peak - before) / 1024),
+        "alloc_net_kb": round((current - before) / 1024),
+        "rss_peak_kb": max(rss_peak, 0),
+    }, result
+
+
+def run_case(minutes: float, latency=0.0, tokens_per_sec=0.0) -> dict:
+    tmp = tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.environ.setdefault("CLIPS_LOG_LEVEL", "error")
+
+    import utils, llm_cache
+    utils.FILE_LOG, utils.FILE_LOG_JSONL = f"{tmp}/logs.txt", f"{tmp}/logs.jsonl"
+    from fn_chuck import chunk_by_time, chunk_by_tokens, token_budget
+    from fn_parsers import fuzzy_parse_fullTexts
+    from fn_query import query_clip_trailer_fulltext, query_chunks
+    from fn_post_processing import post_dedup_overlapping_clips, post_clean_obvious_clips, post_query_filter_relevant_clip
+    from llm_transport import ReplayTransport, set_transport
+    from benchmarks.synthetic import make_transcript
+    import llm_synthetic
+    set_transport(ReplayTransport(responder=llm_synthetic.answer, latency=latency, tokens_per_sec=tokens_per_sec or None))
+
+    caches = count()
+    def fresh_cache():
+        cache = llm_cache.LLMCache(f"{tmp}/llm_cache_{next(caches)}.sqlite")
+        llm_cache.set_llm_cache(cache)
+        return cache
+
+    transcript = make_transcript(minutes)
+    segments = transcript["segments"]
+    budget = token_budget(MODEL_NAME)
+    chunks = list(chunk_by_tokens(segments, budget))
+    responses = [llm_synthetic.answer(" ".join(seg["text"].lower() for seg in chunk)) for chunk in chunks]
+
+    def parse():
+        return [clip for chunk, response in zip(chunks, responses) for clip in fuzzy_parse_fullTexts(response, chunk, None)]
+
+    highlights = parse()
+
+    def cache_roundtrip():
+        cache = fresh_cache()
+        keys = [llm_cache.cache_key(MODEL_NAME, [{"role": "user", "content": response}], {}) for response in responses]
+        for key, response in zip(keys, responses):
+            cache.set(key, MODEL_NAME, response)
+        return [cache.get(key) for key in keys]
+
+    def pipeline():
+        fresh_cache()
+        results = [clip for part in query_chunks(query_clip_trailer_fulltext, chunks, MODEL_NAME, utils.LLM_OPTIONS["best_b"]) for clip in part]
+        results = post_dedup_overlapping_clips(results)
+        results = post_clean_obvious_clips(results)
+        return post_query_filter_relevant_clip(results, MODEL_NAME)
+
+    stages = {}
+    try:
+        stages["chunk_by_time"], _ = measure(chunk_by_time, segments)
+        stages["chunk_by_tokens"], _ = measure(lambda: list(chunk_by_tokens(segments, budget)))
+        stages["parse"], _ = measure(parse)
+        stages["dedup"], _ = measure(post_dedup_overlapping_clips, highlights)
+        stages["clean"], _ = measure(post_clean_obvious_clips, highlights)
+        stages["cache"], _ = measure(cache_roundtrip)
+        stages["pipeline"], kept = measure(pipeline)
+    finally:
+        utils.flush_logs()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return {
+        "minutes": minutes,
+        "words": len(transcript["word_segments"]),
+        "chunks": len(chunks),
+        "highlights": len(highlights),
+        "clips_kept": len(kept),
+        "stages": stages,
+    }
+
+
+def import_report(module="main", top=8) -> dict:
+    """`-X importtime` of importing `module` in a fresh interpreter: total, slowest direct imports, heavy modules loaded."""
+    started = perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=DIR_CLIPS, capture_output=True, text=True)
+    wall = perf_counter() - started
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((depth, name.strip(), int(self_us), int(cumulative_us)))
+
+    # children are printed before their parent, so `module`'s imports are the nested lines right above it
+    end = next((i for i, (depth, name, _, _) in enumerate(imports) if depth == 0 and name == module), None)
+    start = end
+    while start and imports[start - 1][0] > 0:
+        start -= 1
+    children = imports[start:end] if end is not None else []
+    root = imports[end][3] if end is not None else 0
+    direct = sorted((i for i in children if i[0] == 1), key=lambda i: -i[3])[:top]
+    loaded = {name for _, name, _, _ in children}
+    return {
+        "module": module,
+        "ok": proc.returncode == 0,
+        "process_sec": round(wall, 3),
+        "import_sec": round(root / 1e6, 3),
+        "within_budget": root / 1e6 < STARTUP_BUDGET_SEC,
+        "slowest": [{"module": name, "cumulative_ms": round(cumulative / 1e3, 1), "self_ms": round(self / 1e3, 1)} for _, name, self, cumulative in direct],
+        "heavy_loaded": [name for name in HEAVY_MODULES if name in loaded],
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=DIR_CLIPS, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main(minutes=DEFAULT_MINUTES, output: str = "", latency=0.0, tokens_per_sec=0.0):
+    cases = []
+    for length in minutes:
+        proc = subprocess.run([sys.executable, __file__, "--case", str(length), "--latency", str(latency), "--tokens-per-sec", str(tokens_per_sec)], capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"case {length}min failed:\n{proc.stderr}")
+        cases.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    results = {
+        "revision": _git_revision(), "python": platform.python_version(), "model": MODEL_NAME, "latency": latency, "tokens_per_sec": tokens_per_sec,
+        "startup": import_report("main"),
+        "cases": cases,
+    }
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"[i] Saved benchmark to '{output}'")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, nargs="+", default=DEFAULT_MINUTES, help="transcript lengths to benchmark")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per LLM request")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="simulated LLM generation speed, 0 for instant")
+    parser.add_argument("--output", default="", help="also write the results to this JSON file")
+    parser.add_argument("--case", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.case is not None:
+        print(json.dumps(run_case(args.case, args.latency, args.tokens_per_sec)))
+    else:
+        main(args.minutes, args.output, args.latency, args.tokens_per_sec)
@@ -0,0 +1,62 @@
+"""
+
+Benchmark: loading a cached transcript, JSON dicts vs the memory-mapped columnar bundle.
+Each load runs in a fresh subprocess so peak RSS is measured in isolation (reads /proc, Linux only).
+Usage: python benchmarks/bench_transcript_store.py [minutes]
+
+"""
+import sys, json, tempfile, subprocess
+from pathlib import Path
+
+DIR_CLIPS = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(DIR_CLIPS))
+from transcript_store import ColumnarTranscript
+from benchmarks.synthetic import make_transcript
+
+# (setup, timed load)
+_LOADERS = {
+    "json": ("import json", "t = json.load(open(path)); n = len(t['segments'])"),
+    "columnar": ("from transcript_store import ColumnarTranscript", "t = ColumnarTranscript.load(path); n = len(t['segments'])"),
+}
+
+_MEASURE = """
+import sys, json, io, contextlib
+from time import perf_counter
+sys.path.insert(0, {clips!r})
+def peak_rss_kb():
+    # VmHWM is reset on exec, unlike ru_maxrss which inherits the parent's peak
+    with open("/proc/self/status") as f:
+        return int(next(line for line in f if line.startswith("VmHWM")).split()[1])
+path = {path!r}
+{setup}
+base = peak_rss_kb()
+started = perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    {load}
+print(json.dumps({{"load_sec": perf_counter() - started, "rss_kb": peak_rss_kb() - base}}))
+"""
+
+
+def measure(kind: str, path: str) -> dict:
+    setup, load = _LOADERS[kind]
+    code = _MEASURE.format(clips=str(DIR_CLIPS), path=path, setup=setup, load=load)
+    return json.loads(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout)
+
+
+def main(minutes=180):
+    transcript = make_transcript(minutes)
+    with tempfile.TemporaryDirectory() as tmp:
+        path_json, path_bundle = f"{tmp}/transcript.json", f"{tmp}/transcript.transcript"
+        with open(path_json, 'w') as f:
+            json.dump(transcript, f)
+        ColumnarTranscript.from_transcript(transcript).save(path_bundle)
+        assert ColumnarTranscript.load(path_bundle).to_transcript() == transcript, "columnar round trip differs"
+        results = {kind: measure(kind, path) for kind, path in (("json", path_json), ("columnar", path_bundle))}
+
+    results["load_speedup"] = round(results["json"]["load_sec"] / max(results["columnar"]["load_sec"], 1e-9), 1)
+    results["rss_ratio"] = round(results["json"]["rss_kb"] / max(results["columnar"]["rss_kb"], 1), 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,50 @@
+"""
+
+Synthetic WhisperX-shaped transcripts for benchmarks.
+Deterministic for a given seed, so numbers are comparable between versions.
+
+"""
+import random, sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import Transcript, Segment, Word, List
+
+WORDS_PER_MINUTE = 150
+
+
+def make_vocabulary(size=5000, seed=0) -> List[str]:
+    rnd = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rnd.choice(letters) for _ in range(rnd.randint(2, 9))) for _ in range(size)]
+
+
+def make_transcript(minutes: float = 180, seed=0) -> Transcript:
+    """Transcript of `minutes` of speech, with zipf-ish word frequencies and 8-25 words per segment."""
+    rnd = random.Random(seed)
+    vocabulary = make_vocabulary(seed=seed)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    total_words = int(minutes * WORDS_PER_MINUTE)
+    tokens = rnd.choices(vocabulary, weights=weights, k=total_words)
+    seconds_per_word = 60 / WORDS_PER_MINUTE
+
+    segments: List[Segment] = []
+    t, i = 0.0, 0
+    while i < total_words:
+        words: List[Word] = []
+        for token in tokens[i:i + rnd.randint(8, 25)]:
+            if rnd.random() < 0.1:
+                token = token.capitalize() + ","
+            duration = seconds_per_word * rnd.uniform(0.6, 1.0)
+            words.append({"word": token, "start": round(t, 3), "end": round(t + duration, 3), "score": round(rnd.uniform(0.4, 1.0), 3)})
+            t += seconds_per_word
+        i += len(words)
+        segments.append({"start": words[0]["start"], "end": words[-1]["end"], "text": " ".join(w["word"] for w in words), "words": words})
+    return {"segments": segments, "word_segments": [w for seg in segments for w in seg["words"]]}
+
+
+def pick_highlights(words: List[Word], count: int, length=40, seed=0) -> List[str]:
+    """Verbatim excerpts of `length` words, like a well-behaved LLM would return them."""
+    rnd = random.Random(seed)
+    starts = sorted(rnd.randrange(0, len(words) - length) for _ in range(count))
+    return [" ".join(w["word"] for w in words[s:s + length]) for s in starts]
@@ -0,0 +1,113 @@
+"""
+
+Approximate alignment of LLM highlights onto transcript words.
+LLMs paraphrase, drop punctuation or change casing, so exact n-gram matching misses.
+Here both sides become integer token ids, candidate locations are found by seeding on shared
+k-grams, and each candidate is scored with a banded (windowed) edit distance in numpy.
+
+"""
+import re
+import numpy as np
+from utils import List, Optional, Tuple
+
+_NOT_WORD = re.compile(r"[^\w']+")
+
+
+def normalize(word: str) -> str:
+    """Lowercase, strip punctuation but keep inner apostrophes, eg. "That’s," -> "that's"."""
+    return _NOT_WORD.sub("", word.lower().replace("’", "'")).strip("'")
+
+
+def _kgram_hashes(ids: np.ndarray, k: int) -> np.ndarray:
+    """One int64 per k-gram (ids must fit in 20 bits), -1 where a k-gram holds an unknown token."""
+    if len(ids) < k:
+        return np.empty(0, dtype=np.int64)
+    hashes = np.zeros(len(ids) - k + 1, dtype=np.int64)
+    unknown = np.zeros(len(hashes), dtype=bool)
+    for offset in range(k):
+        part = ids[offset:offset + len(hashes)].astype(np.int64)
+        hashes = (hashes << 20) | (part & 0xFFFFF)
+        unknown |= part < 0
+    hashes[unknown] = -1
+    return hashes
+
+
+def _semi_global_end(query: np.ndarray, text: np.ndarray) -> Tuple[int, int]:
+    """
+    Edit distance of `query` against its best matching substring of `text` that starts anywhere.
+    Returns (end position in `text`, distance). Rows are computed vectorized; insertions along a row
+    are resolved with a running minimum.
+    """
+    steps = np.arange(len(text) + 1)
+    row = np.zeros(len(text) + 1, dtype=np.int32)
+    for i, token in enumerate(query, 1):
+        best = np.empty_like(row)
+        best[0] = i
+        best[1:] = np.minimum(row[:-1] + (text != token), row[1:] + 1)
+        row = np.minimum.accumulate(best - steps) + steps
+    end = int(np.argmin(row))
+    return end, int(row[end])
+
+
+class Aligner:
+    """Token-id view of a transcript that maps free-form highlights to their best word span."""
+
+    def __init__(self, words: List[str], seed_k: int = 3, min_score: float = 0.6):
+        self.seed_k = seed_k
+        self.min_score = min_score
+        self.vocab: dict[str, int] = {}
+        self.tokens = np.array([self.vocab.setdefault(normalize(w), len(self.vocab)) for w in words], dtype=np.int32)
+        self._seeds = {}
+
+    def encode(self, words: List[str]) -> np.ndarray:
+        """Token ids of highlight words, -1 for words the transcript never contains."""
+        normalized = [normalize(w) for w in words]
+        return np.array([self.vocab.get(w, -1) for w in normalized if w], dtype=np.int32)
+
+    def _seed_index(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if k not in self._seeds:
+            hashes = _kgram_hashes(self.tokens, k)
+            order = np.argsort(hashes, kind="stable")
+            self._seeds[k] = (hashes[order], order)
+        return self._seeds[k]
+
+    def _candidate_diagonals(self, query: np.ndarray, band: int, limit=3) -> np.ndarray:
+        """Most voted start offsets (transcript pos - query pos) over all shared k-grams."""
+        for k in (self.seed_k, 1):
+            sorted_hashes, positions = self._seed_index(k)
+            query_hashes = _kgram_hashes(query, k)
+            lo = np.searchsorted(sorted_hashes, query_hashes, side="left")
+            hi = np.searchsorted(sorted_hashes, query_hashes, side="right")
+            counts = np.where(query_hashes >= 0, hi - lo, 0)
+            if counts.sum() == 0:
+                continue
+            query_offsets = np.repeat(np.arange(len(query_hashes)), counts)
+            starts = np.repeat(lo, counts)
+            within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            diagonals = positions[starts + within] - query_offsets
+            bins, votes = np.unique(diagonals // band, return_counts=True)
+            return bins[np.argsort(-votes, kind="stable")[:limit]] * band
+        return np.empty(0, dtype=np.int64)
+
+    def align(self, words: List[str]) -> Optional[Tuple[int, int, float]]:
+        """
+        Best matching word range [start, end) for `words` with a similarity score in [0, 1]
+        (1 - edit distance / highlight length), or None when nothing reaches `min_score`.
+        """
+        query = self.encode(words)
+        if len(query) == 0 or len(self.tokens) == 0:
+            return None
+        band = max(8, len(query) // 4)
+        best = None
+        for diagonal in self._candidate_diagonals(query, band):
+            lo = max(0, int(diagonal) - band)
+            hi = min(len(self.tokens), int(diagonal) + len(query) + 2 * band)
+            window = self.tokens[lo:hi]
+            end, distance = _semi_global_end(query, window)
+            span_length, _ = _semi_global_end(query[::-1], window[:end][::-1])
+            score = 1 - distance / len(query)
+            if best is None or score > best[2]:
+                best = (lo + end - span_length, lo + end, score)
+        if best is None or best[2] < self.min_score or best[1] <= best[0]:
+            return None
+        return best
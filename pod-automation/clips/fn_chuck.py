@@ -1,21 +1,87 @@
-from utils import Clip, AllClips
+from bisect import bisect_left, bisect_right
+from utils import Clip, AllClips, Segment, Iterable, Iterator, List, Optional
+from utils import MODEL_CONTEXT, DEFAULT_CONTEXT
+
+# room left in the context window for the instructions and the answer
+CHUNK_RESERVE_TOKENS = 1024
+# even with long context models, a few focused chunks give better excerpts than one huge one
+MAX_CHUNK_TOKENS = 8192
+CHARS_PER_TOKEN = 4
 
 def chunk_by_time(segments:Clip, minutes:int=10, overlap_seconds:int=60) -> AllClips:
     """
     function is used to chuck the transcribed words into sections (10min by default) with some overlap.
     This is used to feed as chucked contexts to the LLM.
     """
+    return list(chunk_stream(segments, minutes, overlap_seconds))
+
+
+def chunk_stream(segments:Iterable[Segment], minutes:int=10, overlap_seconds:int=60) -> Iterator[Clip]:
+    """
+    Same as `chunk_by_time`, but consumes segments lazily and yields each chunk as soon as it is closed,
+    so a streaming transcription can feed the LLM before it has finished.
+    """
     chunk_duration = minutes * 60    
-    chunks = []
     current_chunk = []
     current_start = 0
     for seg in segments:
-        if seg['end'] <= current_start + chunk_duration:
+        if not current_chunk or seg['end'] <= current_start + chunk_duration:
             current_chunk.append(seg)
         else:
-            chunks.append(current_chunk)
+            yield current_chunk
             current_start = current_chunk[-1]['end'] - overlap_seconds
-            current_chunk = [seg]
+            # carry the last `overlap_seconds` over, so highlights spanning the boundary are not lost
+            current_chunk = [s for s in current_chunk if s['end'] > current_start] + [seg]
     if current_chunk:
-        chunks.append(current_chunk)
-    return chunks
\ No newline at end of file
+        yield current_chunk
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def model_context(model_name: str) -> int:
+    return MODEL_CONTEXT.get(model_name, DEFAULT_CONTEXT)
+
+
+def token_budget(model_name: str) -> int:
+    """Transcript tokens per chunk that fit `model_name`'s context next to the prompt and answer."""
+    return max(256, min(MAX_CHUNK_TOKENS, model_context(model_name) - CHUNK_RESERVE_TOKENS))
+
+
+def context_options(model_name: str, options: Optional[dict] = None) -> dict:
+    """
+    `options` with the `num_ctx` that `token_budget` sized the chunks for. Without it ollama runs the model with
+    its default window (2048) and silently truncates every larger chunk.
+    """
+    return {"num_ctx": model_context(model_name), **(options or {})}
+
+
+def chunk_by_tokens(segments:Iterable[Segment], max_tokens:int, overlap_seconds:int=60) -> Iterator[Clip]:
+    """
+    Chunks that fill `max_tokens` (see `token_budget`), each starting with the last `overlap_seconds` of the previous one.
+    Keeps prefix sums of token counts and segment ends for the open window, so the overlap start is a binary search
+    and the whole run is linear in the number of segments. Consumes segments lazily, like `chunk_stream`.
+    """
+    window: List[Segment] = []
+    ends: List[float] = []
+    prefix: List[int] = [0]
+    for seg in segments:
+        tokens = estimate_tokens(seg['text'])
+        if window and prefix[-1] + tokens > max_tokens:
+            yield window
+            keep_from = min(len(window), max(
+                bisect_right(ends, ends[-1] - overlap_seconds),
+                # the overlap never takes more than half of the next chunk
+                bisect_left(prefix, prefix[-1] - max_tokens // 2),
+                # and always leaves room for the segment that opens it (none for one over budget on its own)
+                bisect_left(prefix, prefix[-1] + tokens - max_tokens),
+                1,
+            ))
+            window, ends = window[keep_from:], ends[keep_from:]
+            prefix = [p - prefix[keep_from] for p in prefix[keep_from:]]
+        window.append(seg)
+        ends.append(seg['end'])
+        prefix.append(prefix[-1] + tokens)
+    if window:
+        yield window
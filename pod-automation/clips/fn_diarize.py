@@ -0,0 +1,115 @@
+"""
+
+Optional diarization stage.
+Speaker turns come from `whisperx.DiarizationPipeline` on the cached audio, in a separate process so it runs while
+transcription, alignment and the LLM queries go on in this one. The turns are then assigned to the words and segments
+of the transcript that is already aligned and cached, there is no second ASR pass just to get speaker labels.
+
+"""
+import os, multiprocessing
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor, Future
+import numpy as np
+from utils import log, format_duration
+from utils import DIR_CACHE
+from utils import SpeakerTurn, List, Optional
+from transcript_store import ColumnarTranscript
+from fn_transcribe import load_cached_transcript, save_transcript
+from tracing import tracer
+
+# `True` uses the token stored by `huggingface-cli login`
+HF_TOKEN = os.environ.get("HF_TOKEN") or True
+
+
+def diarize(video_path: str, device="cpu", min_speakers: Optional[int] = None, max_speakers: Optional[int] = None) -> tuple:
+    """Speaker turns of the video and the seconds it took. Runs in the diarization process."""
+    import whisperx
+    from audio_cache import load_audio
+    started = perf_counter()
+    audio = load_audio(video_path)
+    pipeline = whisperx.DiarizationPipeline(use_auth_token=HF_TOKEN, device=device)
+    frame = pipeline(audio, min_speakers=min_speakers, max_speakers=max_speakers)
+    turns: List[SpeakerTurn] = [
+        {"start": float(start), "end": float(end), "speaker": str(speaker)}
+        for start, end, speaker in zip(frame["start"], frame["end"], frame["speaker"])
+    ]
+    return turns, perf_counter() - started
+
+
+def is_diarized(guest_name: str) -> bool:
+    return os.path.exists(f"{DIR_CACHE}/{guest_name}.transcript/speakers.json")
+
+
+def start_diarization(video_path: str, **kwargs) -> Future:
+    """
+    Submit `diarize` to a fresh process, its future resolves to `(turns, seconds)`.
+    Spawned, not forked: this process already runs threads (logging, pipeline stages) and maybe torch.
+    """
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    future = pool.submit(diarize, video_path, **kwargs)
+    # the process exits once the result is in, nothing waits on the pool itself
+    pool.shutdown(wait=False)
+    log(f"[+] Diarizing '{video_path}' in the background...")
+    return future
+
+
+def _coverage(turns: List[SpeakerTurn], times: np.ndarray) -> np.ndarray:
+    """Seconds of `turns` (one speaker) before each of `times`, piecewise linear so `cov(end) - cov(start)` is the overlap."""
+    starts = np.array([t["start"] for t in turns], dtype=np.float64)
+    ends = np.array([t["end"] for t in turns], dtype=np.float64)
+    order = np.argsort(starts)
+    starts, ends = starts[order], np.maximum.accumulate(ends[order])
+    # merge turns that overlap, the knots of the coverage function have to increase
+    first = np.r_[True, starts[1:] > ends[:-1]]
+    last = np.r_[first[1:], True]
+    starts, ends = starts[first], ends[last]
+    before = np.r_[0.0, np.cumsum(ends - starts)[:-1]]
+    knots_x = np.column_stack([starts, ends]).ravel()
+    knots_y = np.column_stack([before, before + ends - starts]).ravel()
+    return np.interp(times, knots_x, knots_y)
+
+
+def assign_speakers(starts: np.ndarray, ends: np.ndarray, turns: List[SpeakerTurn]) -> tuple:
+    """
+    Index of the speaker overlapping each `[start, end]` interval the most, -1 when none does (or the interval has no timing),
+    the same rule as `whisperx.assign_word_speakers`. Vectorized per speaker, so linear in words and turns.
+    """
+    speakers = sorted({t["speaker"] for t in turns})
+    if not speakers:
+        return speakers, np.full(len(starts), -1, dtype=np.int16)
+    overlap = np.zeros((len(speakers), len(starts)))
+    for i, speaker in enumerate(speakers):
+        own = [t for t in turns if t["speaker"] == speaker]
+        overlap[i] = _coverage(own, ends) - _coverage(own, starts)
+    overlap = np.nan_to_num(overlap, nan=0.0)
+    best = overlap.argmax(axis=0)
+    best[overlap.max(axis=0) <= 0] = -1
+    return speakers, best.astype(np.int16)
+
+
+def label_transcript(guest_name: str, transcript: ColumnarTranscript, turns: List[SpeakerTurn]) -> ColumnarTranscript:
+    """Add speaker labels to the transcript and save it as the cached one."""
+    with tracer.span("label_speakers", turns=len(turns)):
+        speakers, word_speaker = assign_speakers(transcript.word_start, transcript.word_end, turns)
+        _, seg_speaker = assign_speakers(transcript.seg_start, transcript.seg_end, turns)
+        transcript.set_speakers(speakers, word_speaker, seg_speaker)
+        save_transcript(guest_name, transcript)
+    labeled = np.count_nonzero(word_speaker >= 0)
+    log(f"[+] Labeled {labeled}/{len(word_speaker)} words with {len(speakers)} speakers")
+    return transcript
+
+
+def finish_diarization(diarization: Future, guest_name: str) -> Optional[ColumnarTranscript]:
+    """Wait for the background diarization and label the cached transcript, None if it failed (the stage is optional)."""
+    with tracer.span("diarize_wait") as span:
+        try:
+            turns, seconds = diarization.result()
+        except Exception as e:
+            log(f"[ERR] Diarization failed ({e}), the transcript stays unlabeled")
+            return None
+    log(f"[+] Diarization took {format_duration(seconds)}, waited {format_duration(span.elapsed)} for it")
+    transcript = load_cached_transcript(guest_name)
+    if transcript is None:
+        log(f"[ERR] No cached transcript of '{guest_name}' to label")
+        return None
+    return label_transcript(guest_name, transcript, turns)
@@ -0,0 +1,56 @@
+"""
+
+Keyframe index of a source video, built once with ffprobe and cached next to the transcript.
+Used by the smart-cut mode of `fn_save_clips` to know where stream copy can start and stop.
+
+"""
+import os, json, subprocess
+from utils import load_cache, save_cache, log, format_duration
+from utils import KeyframeIndex
+from utils import DIR_CACHE
+from tracing import tracer
+
+
+def _probe(video_path: str, *args: str) -> str:
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0", *args, "-of", "csv=p=0", video_path]
+    return subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+
+
+def probe_stream(video_path: str, stream: str, fields: str) -> dict:
+    """`fields` of the first `stream` ("v:0", "a:0") as ffprobe reports them, empty if the source has no such stream."""
+    cmd = ["ffprobe", "-v", "error", "-select_streams", stream, "-show_entries", f"stream={fields}", "-of", "json", video_path]
+    streams = json.loads(subprocess.run(cmd, capture_output=True, text=True, check=True).stdout or "{}").get("streams") or [{}]
+    return streams[0]
+
+
+def build_keyframe_index(video_path: str) -> KeyframeIndex:
+    """Reads packet flags only (no decoding), so this costs about one pass of disk I/O over the source."""
+    keyframes = []
+    for line in _probe(video_path, "-show_entries", "packet=pts_time,flags").splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time))
+    # what the re-encoded edges of a smart cut have to match to be joined with the stream copied middle
+    video = probe_stream(video_path, "v:0", "codec_name,profile,level,pix_fmt,time_base,color_range,color_space,color_transfer,color_primaries")
+    audio = probe_stream(video_path, "a:0", "codec_name,sample_rate,channels,bit_rate")
+    stat = os.stat(video_path)
+    return {
+        "keyframes": sorted(keyframes), "codec": video.get("codec_name", ""), "pix_fmt": video.get("pix_fmt", ""),
+        "video": video, "audio": audio, "size": stat.st_size, "mtime": stat.st_mtime,
+    }
+
+
+def load_keyframe_index(video_path: str, guest_name: str) -> KeyframeIndex:
+    """Cached index for `video_path`, rebuilt when the source file changed."""
+    path_index = f"{DIR_CACHE}/{guest_name}.keyframes.json"
+    stat = os.stat(video_path)
+    index = load_cache(path_index) if os.path.exists(path_index) else None
+    # indexes from before the stream parameters were probed are rebuilt too
+    if index and "video" in index and index["size"] == stat.st_size and index["mtime"] == stat.st_mtime:
+        return index
+
+    with tracer.span("keyframe_index", video=video_path) as span:
+        index = build_keyframe_index(video_path)
+        save_cache(path_index, index)
+    log(f"[+] Keyframe index: {len(index['keyframes'])} keyframes ({index['codec']}) in {format_duration(span.elapsed)}")
+    return index
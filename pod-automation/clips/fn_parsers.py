@@ -1,8 +1,45 @@
 import json
+from bisect import bisect_right
 from utils import log
-from utils import Clip, List, PostQueryResults
+from utils import Clip, List, PostQueryResults, Optional, Tuple, Word, Iterable
+from tracing import tracer
 
-def fuzzy_parse_fullTexts(response: str, clip: Clip, retry) -> PostQueryResults:
+
+class NgramIndex:
+    """
+    Hash index of every `n`-gram (lowercased) in a transcript to its sorted word positions.
+    Built once per chunk, a highlight then maps in O(highlight length) instead of rescanning the transcript.
+    """
+    def __init__(self, words: List[str], n: int = 8):
+        self.n = n
+        self.size = len(words)
+        self.positions: dict[tuple, List[int]] = {}
+        tokens = [w.lower() for w in words]
+        for i in range(len(tokens) - n + 1):
+            self.positions.setdefault(tuple(tokens[i:i+n]), []).append(i)
+
+    def find(self, words: List[str], after: int = -1) -> Optional[int]:
+        """First position > `after` where the n-gram `words` starts, if any."""
+        positions = self.positions.get(tuple(w.lower() for w in words))
+        if not positions:
+            return None
+        i = bisect_right(positions, after)
+        return positions[i] if i < len(positions) else None
+
+    def find_span(self, words: List[str]) -> Optional[Tuple[int, int]]:
+        """
+        Word range [start, end) whose first and last n words match those of `words` exactly.
+        The start is the first match of the opening n-gram, the end the first later match of the closing one.
+        """
+        start_idx = self.find(words[:self.n])
+        if start_idx is None:
+            return None
+        end_idx = self.find(words[-self.n:], after=start_idx)
+        if end_idx is None:
+            return None
+        return start_idx, end_idx + self.n
+
+def fuzzy_parse_fullTexts(response: str, clip: Clip, retry=None) -> PostQueryResults:
     """
     Parse an LLM response into highlights and map them back to transcript words.
 
@@ -14,9 +51,16 @@ def fuzzy_parse_fullTexts(response: str, clip: Clip, retry) -> PostQueryResults:
     3. Ensure highlights is a list of strings
     4. Fuzzy map each highlight to transcript word indices
     """
-    reconstructed_clips: PostQueryResults = []
-    highlights: List[str] = []
+    highlights = parse_highlights(response)
+    if highlights is None:
+        if retry:
+            retry()
+        return []
+    return map_highlights(highlights, clip)
+
 
+def parse_highlights(response: str) -> Optional[list]:
+    """Steps 1-3 of `fuzzy_parse_fullTexts`, None if the response isn't (and doesn't contain) a JSON list."""
     try:
         # --- Step 1: strict parse
         highlights = json.loads(response)
@@ -33,58 +77,163 @@ def fuzzy_parse_fullTexts(response: str, clip: Clip, retry) -> PostQueryResults:
                 raise ValueError("No JSON-like brackets found in response")
         except Exception as inner_e:
             log(f"[ERR] fuzzy_parse_fullTexts: Failed to parse LLM output as JSON ({inner_e})")
-            return []
+            return None
 
-    # --- Step 2: sanitize highlights
+    # --- Step 3: sanitize highlights
     if not isinstance(highlights, list):
         log(f"[ERR] fuzzy_parse_fullTexts: Parsed output is not a JSON list.")
-        if retry:
-            retry()
-        return []
-    # --- Step 3: fuzzy map
-    transcript_words = [word for seg in clip for word in seg["words"]]
-    transcript_words_cleaned = [w['word'].lower() for w in transcript_words]
-
-    search_window = 8
-    for highlight_text in highlights:
-        if len(highlight_text) < 10:
-            print(f"[skip] fuzzy_parse_fullTexts: Highlight too short — '{highlight_text[:50]}...'")
-            continue
-
-        fuzzy_words = highlight_text.split()
-        start_snippet = " ".join(fuzzy_words[:search_window]).lower()
-        end_snippet = " ".join(fuzzy_words[-search_window:]).lower()
-
-        start_idx, end_idx = None, None
-        for i in range(len(transcript_words_cleaned) - search_window + 1):
-            words_slice = " ".join(transcript_words_cleaned[i:i+search_window])
-            if start_idx is None and words_slice == start_snippet:
-                start_idx = i
-                continue
-            if start_idx is not None and words_slice == end_snippet:
-                end_idx = i + search_window
-                break
+        return None
+    return highlights
+
 
-        if start_idx is None or end_idx is None or end_idx <= start_idx:
-            log(f"[ERR] fuzzy_parse_fullTexts: Could not map highlight — '{highlight_text[:30]}...'")
-            continue
-
-        reconstructed_clips.append(transcript_words[start_idx:end_idx])
-        
-
-    # print(' ')
-    # print(' ')
-    # print('highlights:')
-    # print(highlights[1])
-    # print(' ')
-    # print(' ')
-    
-    # print(' ')
-    # print(' ')
-    # print('reconstructed_clips:')
-    # print([" ".join([w['word'] for w in i]) for i in reconstructed_clips][1])
-    # print(' ')
-    # print(' ')
-    # exit(0)
+def map_highlights(highlights: list, clip: Clip) -> PostQueryResults:
+    """Step 4 of `fuzzy_parse_fullTexts`."""
+    mapper = HighlightMapper(clip)
+    reconstructed_clips = [words for words in map(mapper.map, highlights) if words]
+
+    tracer.count("highlights", len(highlights))
+    tracer.count("highlights_mapped", len(reconstructed_clips))
     log(f"[+] fuzzy_parse_fullTexts: {len(reconstructed_clips)}/{len(highlights)} parsed highlights.")
-    return reconstructed_clips
\ No newline at end of file
+    return reconstructed_clips
+
+
+class HighlightMapper:
+    """Maps highlight texts back to the words of `clip`: exact n-gram match first, approximate alignment as fallback."""
+    def __init__(self, clip: Clip):
+        self.words: List[Word] = [word for seg in clip for word in seg["words"]]
+        self.index = NgramIndex([w['word'] for w in self.words])
+        self.aligner: Optional["Aligner"] = None
+
+    def map(self, highlight_text: str) -> Optional[List[Word]]:
+        if not isinstance(highlight_text, str) or len(highlight_text) < 10:
+            print(f"[skip] fuzzy_parse_fullTexts: Highlight too short — '{str(highlight_text)[:50]}...'")
+            return None
+
+        span = self.index.find_span(highlight_text.split())
+        if span is None:
+            # exact match failed (paraphrase, punctuation, casing), fall back to approximate alignment
+            if self.aligner is None:
+                # numpy backed, only loaded once a highlight needs it
+                from fn_align import Aligner
+                self.aligner = Aligner([w['word'] for w in self.words])
+            aligned = self.aligner.align(highlight_text.split())
+            if aligned is None:
+                log(f"[ERR] fuzzy_parse_fullTexts: Could not map highlight — '{highlight_text[:30]}...'")
+                return None
+            span = aligned[:2]
+            log(f"[~] fuzzy_parse_fullTexts: Approximately mapped highlight (score {aligned[2]:.2f}) — '{highlight_text[:30]}...'")
+
+        start_idx, end_idx = span
+        tracer.count("words_mapped", end_idx - start_idx)
+        return self.words[start_idx:end_idx]
+
+
+class JsonArrayStream:
+    """
+    Incremental parser for the expected answer shape, a JSON array of strings.
+    `feed` returns the strings closed by each piece of output. Parsing stops (`failed`) as soon as the output can't be
+    that shape anymore: no '[' within `max_preamble` chars (prose, thinking), a non-string item or a runaway string.
+    """
+    def __init__(self, max_preamble=200, max_string=4000):
+        self.max_preamble = max_preamble
+        self.max_string = max_string
+        self.state = "start"  # start | array | string | escape | done | failed
+        self.error = ""
+        self.consumed = 0
+        self._pieces: List[str] = []
+        self._array: List[str] = []
+        self._string: List[str] = []
+
+    @property
+    def done(self) -> bool:
+        return self.state == "done"
+
+    @property
+    def failed(self) -> bool:
+        return self.state == "failed"
+
+    @property
+    def text(self) -> str:
+        """The array parsed so far, as JSON text."""
+        return "".join(self._array)
+
+    @property
+    def raw(self) -> str:
+        """Everything fed so far, including what comes after a parse error."""
+        return "".join(self._pieces)
+
+    def _fail(self, error: str) -> None:
+        self.state, self.error = "failed", error
+
+    def feed(self, piece: str) -> List[str]:
+        closed = []
+        self._pieces.append(piece)
+        for ch in piece:
+            if self.state in ("done", "failed"):
+                break
+            self.consumed += 1
+            if self.state == "start":
+                if ch == "[":
+                    self.state = "array"
+                    self._array.append(ch)
+                elif self.consumed > self.max_preamble:
+                    self._fail(f"no JSON array within the first {self.max_preamble} chars")
+                continue
+
+            self._array.append(ch)
+            if self.state == "array":
+                if ch == '"':
+                    self.state = "string"
+                elif ch == "]":
+                    self.state = "done"
+                elif not (ch.isspace() or ch == ","):
+                    self._fail(f"unexpected '{ch}' in the array")
+            elif self.state == "escape":
+                self._string.append(ch)
+                self.state = "string"
+            elif ch == "\\":
+                self._string.append(ch)
+                self.state = "escape"
+            elif ch == '"':
+                try:
+                    closed.append(json.loads('"' + "".join(self._string) + '"'))
+                    self.state = "array"
+                except ValueError as e:
+                    self._fail(f"invalid string ({e})")
+                self._string = []
+            elif len(self._string) >= self.max_string:
+                self._fail(f"string longer than {self.max_string} chars")
+            else:
+                self._string.append(ch)
+        return closed
+
+
+def stream_parse_fullTexts(pieces: Iterable[str], clip: Clip) -> Tuple[PostQueryResults, JsonArrayStream]:
+    """
+    Streaming variant of `fuzzy_parse_fullTexts`: consumes the LLM output piece by piece and maps every highlight as
+    soon as its string closes. Stops consuming (which aborts the generation) once the array is closed or the output
+    is clearly not a JSON array of strings.
+    Returns the mapped clips and the parser, `parser.done` tells whether a complete array was received.
+    """
+    parser = JsonArrayStream()
+    mapper = HighlightMapper(clip)
+    reconstructed_clips: PostQueryResults = []
+    highlights = 0
+    for piece in pieces:
+        for highlight_text in parser.feed(piece):
+            highlights += 1
+            words = mapper.map(highlight_text)
+            if words:
+                reconstructed_clips.append(words)
+        if parser.done or parser.failed:
+            break
+
+    tracer.count("highlights", highlights)
+    tracer.count("highlights_mapped", len(reconstructed_clips))
+    if not parser.done:
+        parser.error = parser.error or "output ended before the array closed"
+        tracer.count("stream_aborted")
+        log(f"[ERR] stream_parse_fullTexts: Stopped reading LLM output after {parser.consumed} chars ({parser.error})")
+    else:
+        log(f"[+] stream_parse_fullTexts: {len(reconstructed_clips)}/{highlights} parsed highlights.")
+    return reconstructed_clips, parser
@@ -3,9 +3,202 @@
 Post-processing scripts
 
 """
-import ollama
+import json, threading
+from contextvars import copy_context
+from random import random
+from concurrent.futures import ThreadPoolExecutor
 from utils import log
-from utils import PostQueryResults, List, AllClips
+from utils import PostQueryResults, List, AllClips, Word, Optional, Tuple
+from utils import LLM_MAX_PARALLEL, LLM_SLOTS
+from llm_cache import get_llm_cache, cache_key
+from llm_transport import get_transport
+from tracing import count_usage
+
+RELEVANCE_BATCH_SIZE = 10
+DEDUP_OVERLAP_THRESHOLD = 0.5
+
+# instructions first and the clips last, so relevance requests share a cacheable prompt prefix
+PROMPT_RELEVANCE = """
+Decide if the clip in the next message is interesting enough to keep.
+Criteria:
+- Emotionally engaging OR intellectually valuable
+
+
+Reply strictly with either "YES" or "NO"
+"""
+
+PROMPT_RELEVANCE_BATCH = """
+Decide for each numbered clip in the next message if it is interesting enough to keep.
+Criteria:
+- Emotionally engaging OR intellectually valuable
+
+
+Reply strictly with a JSON object that maps every clip number to either "YES" or "NO", like: {"1": "YES", "2": "NO"}
+"""
+
+def post_dedup_overlapping_clips(results:PostQueryResults, overlap_threshold=DEDUP_OVERLAP_THRESHOLD):
+    """
+    Drop clips that overlap a better scoring clip by at least `overlap_threshold` (of the shorter one).
+    Overlapping chunks and the LLM picking the same moment twice both produce such duplicates.
+    Best scoring clips (mean word score) are kept first, O(n log n) overall (see `IntervalIndex`).
+    Clips `post_clean_obvious_clips` will throw out are passed through as they are, they never suppress a valid one.
+    Input: list of slips
+    Output: filtered list of slips, in their original order
+    """
+    index = IntervalIndex(overlap_threshold)
+    candidates = sorted((i for i, clip in enumerate(results) if is_obvious_clip(clip)), key=lambda i: -clip_score(results[i]))
+    dropped = set()
+    for i in candidates:
+        start, end = results[i][0]['start'], results[i][-1]['end']
+        if index.overlaps(start, end):
+            dropped.add(i)
+        else:
+            index.add(start, end)
+    deduped: PostQueryResults = [clip for i, clip in enumerate(results) if i not in dropped]
+    log(f"[+] POST. post_dedup_overlapping_clips: {len(deduped)}/{len(results)} clips left")
+    return deduped
+
+
+class StreamingDedup:
+    """
+    `post_dedup_overlapping_clips` over the clips of chunks that arrive in any order, with the same outcome as one
+    call over all of them. Chunks start later and later, so once every chunk up to `j` has arrived, no clip of a
+    later chunk can reach before chunk `j`'s start: groups of overlapping clips that end before it are complete and
+    deduped, the rest is held back. `add` and `flush` return the clips that got through, not thread safe.
+    """
+    def __init__(self, overlap_threshold=DEDUP_OVERLAP_THRESHOLD):
+        self.overlap_threshold = overlap_threshold
+        self._chunk_starts: dict[int, float] = {}
+        self._complete = 0
+        self._pending: PostQueryResults = []
+
+    def add(self, chunk_index:int, chunk_start:float, clips:PostQueryResults) -> PostQueryResults:
+        self._chunk_starts[chunk_index] = chunk_start
+        while self._complete in self._chunk_starts:
+            self._complete += 1
+        # clips clean will drop don't take part, see `post_dedup_overlapping_clips`
+        passed = [clip for clip in clips if not is_obvious_clip(clip)]
+        self._pending += [clip for clip in clips if is_obvious_clip(clip)]
+        if self._complete == 0:
+            return passed
+        return passed + self._settle(self._chunk_starts[self._complete - 1])
+
+    def flush(self) -> PostQueryResults:
+        return self._settle(float("inf"))
+
+    def _settle(self, bound:float) -> PostQueryResults:
+        self._pending.sort(key=lambda clip: clip[0]['start'])
+        # the pending clips up to the last gap between overlapping groups before `bound`
+        settled, reach = 0, float("-inf")
+        for k, clip in enumerate(self._pending):
+            if clip[0]['start'] >= reach:
+                if reach > bound:
+                    break
+                settled = k
+            reach = max(reach, clip[-1]['end'])
+        else:
+            if reach <= bound:
+                settled = len(self._pending)
+        done, self._pending = self._pending[:settled], self._pending[settled:]
+        return post_dedup_overlapping_clips(done, self.overlap_threshold) if done else []
+
+
+def clip_score(clip:List[Word]) -> float:
+    return sum(w.get('score', 0) for w in clip) / max(1, len(clip))
+
+
+class _Node:
+    __slots__ = ("key", "priority", "left", "right")
+
+    def __init__(self, key: Tuple[float, float]):
+        self.key = key
+        self.priority = random()
+        self.left: Optional["_Node"] = None
+        self.right: Optional["_Node"] = None
+
+
+class IntervalIndex:
+    """
+    Kept [start, end) intervals in a treap ordered by start: O(log n) expected per insert and per neighbour lookup.
+    Kept intervals never contain one another (the contained one would overlap by its whole length), so ordered by
+    start their ends are ordered too. An overlap check then only visits the kept intervals straddling the checked
+    interval's start or end, and stops at the first one inside it: a handful, as kept intervals can't overlap much.
+    """
+    def __init__(self, overlap_threshold=DEDUP_OVERLAP_THRESHOLD):
+        self.overlap_threshold = overlap_threshold
+        self._root: Optional[_Node] = None
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _overlapping(self, start:float, end:float, kept_start:float, kept_end:float) -> bool:
+        shared = min(end, kept_end) - max(start, kept_start)
+        shorter = min(end - start, kept_end - kept_start)
+        return shared > 0 and shared >= self.overlap_threshold * max(shorter, 1e-6)
+
+    def overlaps(self, start:float, end:float) -> bool:
+        if self.overlap_threshold > 1:
+            # more than the whole shorter interval can never be shared
+            return False
+        # kept intervals starting inside [start, end), in order: either inside it, or straddling `end`
+        node = self._ceiling((start, float("-inf")))
+        while node is not None and node.key[0] < end:
+            if self._overlapping(start, end, *node.key):
+                return True
+            node = self._ceiling((node.key[0], node.key[1], 0))
+        # kept intervals starting before it, going back while they still reach past `start`
+        node = self._floor((start, float("-inf")))
+        while node is not None and node.key[1] > start:
+            if self._overlapping(start, end, *node.key):
+                return True
+            node = self._floor(node.key)
+        return False
+
+    def add(self, start:float, end:float) -> None:
+        if end <= start:
+            # shares nothing with any interval, and would break the ordering of the ends
+            return
+        self._root = self._insert(self._root, _Node((start, end)))
+        self._len += 1
+
+    def _insert(self, root: Optional[_Node], node: _Node) -> _Node:
+        if root is None:
+            return node
+        if node.key < root.key:
+            root.left = self._insert(root.left, node)
+            if root.left.priority > root.priority:
+                pivot, root.left = root.left, root.left.right
+                pivot.right = root
+                return pivot
+        else:
+            root.right = self._insert(root.right, node)
+            if root.right.priority > root.priority:
+                pivot, root.right = root.right, root.right.left
+                pivot.left = root
+                return pivot
+        return root
+
+    def _ceiling(self, key: tuple) -> Optional[_Node]:
+        """Node with the smallest key >= `key`."""
+        node, best = self._root, None
+        while node is not None:
+            if node.key >= key:
+                best, node = node, node.left
+            else:
+                node = node.right
+        return best
+
+    def _floor(self, key: tuple) -> Optional[_Node]:
+        """Node with the largest key < `key`."""
+        node, best = self._root, None
+        while node is not None:
+            if node.key < key:
+                best, node = node, node.right
+            else:
+                node = node.left
+        return best
+
 
 def post_clean_obvious_clips(results:PostQueryResults, min_length_sec=5, max_length_sec=60):
     """
@@ -13,40 +206,140 @@ def post_clean_obvious_clips(results:PostQueryResults, min_length_sec=5, max_len
     Input: list of slips
     Output: filtered list of slips
     """
-    cleaned: PostQueryResults = []
-    for clip in results:
-        if len(clip):    
-            duration = clip[-1]['end'] - clip[0]['start']
-            if duration < min_length_sec or duration > max_length_sec:
-                continue
-            cleaned.append(clip)
+    cleaned: PostQueryResults = [clip for clip in results if is_obvious_clip(clip, min_length_sec, max_length_sec)]
     log(f"[+] POST. post_clean_obvious_clips: {len(cleaned)}/{len(results)} clips left")
     return cleaned
 
 
+def is_obvious_clip(clip:List[Word], min_length_sec=5, max_length_sec=60) -> bool:
+    """Single clip check of `post_clean_obvious_clips`, for streaming pipelines."""
+    if not len(clip):
+        return False
+    duration = clip[-1]['end'] - clip[0]['start']
+    return min_length_sec <= duration <= max_length_sec
+
+
 # TODO: update me once more to become relevant ot this code base pls :)
-def post_query_filter_relevant_clip(results:PostQueryResults, model="llama3"):
+def post_query_filter_relevant_clip(results:PostQueryResults, model="llama3", batch_size=RELEVANCE_BATCH_SIZE):
     """
     Use a lightweight LLM to decide if a clip is relevant and worth keeping.
-    Optionally trim start/end text inside the clip.
+    Clips are scored `batch_size` at a time with concurrent requests, decisions are memoized per clip text.
     Input: list of slips
     Output: filtered list of slips
     """
-    filtered = []
-    for clip in results:
-        text = " ".join([w['word'] for w in clip])
-        prompt = f"""
-Decide if the following clip is interesting enough to keep.
-Criteria:
-- Emotionally engaging OR intellectually valuable
+    texts = [clip_text(clip) for clip in results]
+    decisions = [_cached_decision(text, model) for text in texts]
+    pending = [i for i, decision in enumerate(decisions) if decision is None]
+    batches = [pending[k:k + batch_size] for k in range(0, len(pending), batch_size)]
 
+    with ThreadPoolExecutor(max_workers=max(1, min(LLM_MAX_PARALLEL, len(batches)))) as pool:
+        # run in the caller's context, so the relevance calls count towards the episode's span and log fields
+        scored = [pool.submit(copy_context().run, score_relevance_batch, [texts[i] for i in batch], model) for batch in batches]
+        for batch, future in zip(batches, scored):
+            for i, decision in zip(batch, future.result()):
+                decisions[i] = decision
 
-Reply strictly with either "YES" or "NO"
-Clip: `{text}`
-"""
-        resp = ollama.chat(model=model, messages=[{"role": "user", "content": prompt}])
-        decision = resp.message.content.strip().upper()
-        if "YES" in  decision and not "NO" in decision:
-            filtered.append(clip)
-    log(f"[+] POST. post_query_filter_relevant_clip:  {len(filtered)}/{len(results)} clips left")
+    filtered = [clip for clip, keep in zip(results, decisions) if keep]
+    log(f"[+] POST. post_query_filter_relevant_clip:  {len(filtered)}/{len(results)} clips left ({len(batches)} batched calls, {len(results) - len(pending)} memoized)")
     return filtered
+
+
+class RelevanceBatcher:
+    """
+    `post_query_filter_relevant_clip` for clips that arrive a few at a time (eg. per chunk in a streaming pipeline).
+    Clips without a memoized decision are collected across calls and scored `batch_size` at a time, so requests go
+    out as full batches. `add` and `flush` return the clips that are kept, `flush` scores the rest at the end.
+    """
+    def __init__(self, model="llama3", batch_size=RELEVANCE_BATCH_SIZE):
+        self.model = model
+        self.batch_size = batch_size
+        self._waiting: PostQueryResults = []
+        self._lock = threading.Lock()
+
+    def add(self, clips:PostQueryResults) -> PostQueryResults:
+        decisions = [_cached_decision(clip_text(clip), self.model) for clip in clips]
+        with self._lock:
+            self._waiting += [clip for clip, decision in zip(clips, decisions) if decision is None]
+            full = len(self._waiting) // self.batch_size * self.batch_size
+            batch, self._waiting = self._waiting[:full], self._waiting[full:]
+        kept = [clip for clip, decision in zip(clips, decisions) if decision]
+        return kept + (post_query_filter_relevant_clip(batch, self.model, self.batch_size) if batch else [])
+
+    def flush(self) -> PostQueryResults:
+        with self._lock:
+            batch, self._waiting = self._waiting, []
+        return post_query_filter_relevant_clip(batch, self.model, self.batch_size) if batch else []
+
+
+def is_relevant_clip(clip:List[Word], model="llama3") -> bool:
+    """Single clip check of `post_query_filter_relevant_clip`."""
+    text = clip_text(clip)
+    decision = _cached_decision(text, model)
+    if decision is None:
+        decision = _ask_relevance(text, model)
+    return decision
+
+
+def clip_text(clip:List[Word]) -> str:
+    return " ".join([w['word'] for w in clip])
+
+
+def _decision_key(text:str, model:str) -> str:
+    return cache_key(f"relevance/{model}", [{"role": "user", "content": text}])
+
+
+def _cached_decision(text:str, model:str) -> Optional[bool]:
+    cached = get_llm_cache().get(_decision_key(text, model))
+    return None if cached is None else cached == "YES"
+
+
+def _remember_decision(text:str, model:str, decision:bool) -> None:
+    get_llm_cache().set(_decision_key(text, model), model, "YES" if decision else "NO")
+
+
+def _is_yes(answer) -> bool:
+    decision = str(answer).strip().upper()
+    return "YES" in  decision and not "NO" in decision
+
+
+def _ask_relevance(text:str, model:str) -> bool:
+    with LLM_SLOTS:
+        resp = get_transport().chat(model, [
+            {"role": "system", "content": PROMPT_RELEVANCE},
+            {"role": "user", "content": f"Clip: `{text}`"},
+        ])
+    count_usage(resp)
+    decision = _is_yes(resp.content)
+    _remember_decision(text, model, decision)
+    return decision
+
+
+def score_relevance_batch(texts:List[str], model="llama3") -> List[bool]:
+    """
+    One request for several clips, answered as a JSON object of clip number -> "YES"/"NO".
+    Clips the answer doesn't cover (or all of them, if it isn't valid JSON) are asked one by one.
+    """
+    numbered = "\n".join(f"{i}. `{text}`" for i, text in enumerate(texts, 1))
+    answers = {}
+    try:
+        with LLM_SLOTS:
+            resp = get_transport().chat(model, [
+                {"role": "system", "content": PROMPT_RELEVANCE_BATCH},
+                {"role": "user", "content": f"Clips:\n{numbered}"},
+            ], format="json")
+        count_usage(resp)
+        answers = json.loads(resp.content)
+        if not isinstance(answers, dict):
+            raise ValueError("answer is not a JSON object")
+    except Exception as e:
+        log(f"[ERR] score_relevance_batch: Unusable batch answer, falling back to single clips ({e})")
+
+    decisions = []
+    for i, text in enumerate(texts, 1):
+        if str(i) in answers:
+            decision = _is_yes(answers[str(i)])
+            _remember_decision(text, model, decision)
+        else:
+            decision = _ask_relevance(text, model)
+        decisions.append(decision)
+    return decisions
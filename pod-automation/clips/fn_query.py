@@ -1,133 +1,206 @@
-import ollama
-
-from utils import log, timer, load_cache, save_cache, slugify
-from utils import Clip, AllClips
-from utils import DIR_CACHE
-
-from fn_parsers import fuzzy_parse_fullTexts
-
+from time import sleep
+from itertools import islice
+from contextlib import nullcontext, closing
+from contextvars import copy_context
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
+
+from utils import log, format_duration
+from utils import Clip, AllClips, List, Optional, Tuple, PostQueryResults, Iterator
+from utils import LLM_MAX_PARALLEL, LLM_SLOTS, LLM_STREAM
+
+from fn_parsers import parse_highlights, map_highlights, stream_parse_fullTexts
+from fn_chuck import context_options
+from llm_cache import cached_chat, get_llm_cache, cache_key
+from llm_transport import get_transport
+from tracing import tracer, count_usage
+
+# first backoff after a failed request, doubled on every next one
+RETRY_BACKOFF_SEC = 2.0
+# pieces still read after the array closed, the final one carries ollama's token counts and timings
+STREAM_TAIL_PIECES = 16
+# broken answers are sent back for repair up to this length
+REPAIR_MAX_CHARS = 6000
+
+# The instructions are the system message and the chunk text the only user message, so every chunk query starts with
+# the exact same tokens and ollama reuses the KV cache of that prefix instead of evaluating the instructions again.
+SYSTEM_PROMPT = "You are an expert at identifying impactful excerpts from text."
+
+PROMPT_FULLTEXT = f"""{SYSTEM_PROMPT}
+
+You are given a chuck of the full context of a podcast, in the next message.
+Extract the top moments/pieces-of-text from this part, but make sure that:
+- extract about 3 moment of loosely 30 words (doesn't need to be super strict)
+- each should be self-contained and something that stand out, something thats awesome, deep or relatable.
+
+Return ONLY the excerpts in valid JSON format, like this:
+["That was so awesome because.. ", ""]
+
+If no suitable excerpts exist, return [].
+"""
+
+PROMPT_TRAILER = f"""{SYSTEM_PROMPT}
+
+You are given a chuck of the full context of a podcast, in the next message. The goal is to create a trailer with different clips.
+Your tasks is to identify those clips out of a chuck of the full context.
+
+Extract the top moments/pieces-of-text from this part, but take these things into account
+- extract about 3 moment of loosely 30-60 words.
+- each should be self-contained and something that stand out, be a punchline, an interesting question, a "waw" moment, something thats awesome, deep or feel relatable.
+- remember that this is mean.
+
+Return ONLY the excerpts in valid JSON format, like this:
+["Some time ago..", ".. when she knew."]
+
+If no suitable excerpts exist, return an empty array [].
+"""
+
+
+
+def _llm_chat(model_name: str, messages: list, options: dict) -> str:
+    with LLM_SLOTS:
+        chat_response = get_transport().chat(model_name, messages, options)
+    count_usage(chat_response)
+    return chat_response.content
+
+
+def _llm_stream(model_name: str, messages: list, options: dict) -> Iterator[str]:
+    received = 0
+    # the slot is held until the stream is done or closed
+    with LLM_SLOTS, closing(get_transport().stream(model_name, messages, options)) as pieces:
+        try:
+            for piece in pieces:
+                if piece.done:
+                    count_usage(piece)
+                    received = None
+                else:
+                    received += 1
+                yield piece.content
+        finally:
+            # aborted before the final stats, streamed pieces are about a token each
+            if received:
+                tracer.count("tokens_out", received)
+
+
+def _ask_highlights(chuck: Clip, model_name: str, messages: list, options: dict, use_cache=False, stream=LLM_STREAM) -> Tuple[PostQueryResults, str, Optional[str]]:
+    """
+    One request for highlights, mapped to `chuck`. Streamed answers are mapped highlight by highlight while the model
+    is still generating, only complete arrays are cached. Cached answers are parsed in one go.
+    Returns the mapped clips, the raw answer and the reason it is unusable (None if it parsed).
+    """
+    key = cache_key(model_name, messages, options)
+    cached = get_llm_cache().get(key) if use_cache else None
+    if cached is None and stream:
+        with tracer.span("llm", model=model_name, stream=True) as span:
+            with closing(_llm_stream(model_name, messages, options)) as pieces:
+                results, parser = stream_parse_fullTexts(pieces, chuck)
+                if parser.done:
+                    # usually only the end of the answer is left, read it for the timing stats unless the model rambles on
+                    for _ in islice(pieces, STREAM_TAIL_PIECES):
+                        pass
+        log(f"[+] query_fulltext. Took {format_duration(span.elapsed)} ({len(messages[-1]['content'])} chars, streamed)")
+        if parser.done:
+            get_llm_cache().set(key, model_name, parser.text)
+            return results, parser.text, None
+        # the output up to where reading stopped, a broken array in it can still be repaired
+        return results, parser.raw, parser.error
+
+    with tracer.span("llm", model=model_name) as span:
+        content = cached if cached is not None else cached_chat(_llm_chat, model_name, messages, options)
+    log(f"[+] query_fulltext. Took {format_duration(span.elapsed)} ({len(messages[-1]['content'])} chars)")
+    highlights = parse_highlights(content)
+    if highlights is None:
+        return [], content, "not a JSON list"
+    return map_highlights(highlights, chuck), content, None
+
+
+def _repair_messages(content: str) -> list:
+    """Short follow-up that only asks to fix the format of a broken answer, instead of redoing the whole chunk."""
+    return [{"role": "user", "content": f"""
+    Fix the following so it is a valid JSON array of strings. Keep the strings as they are.
+    Reply with ONLY the JSON array.
 
+    ```
+    {content[:REPAIR_MAX_CHARS]}
+    ```
+    """}]
+
+
+def query_with_retries(chuck: Clip, model_name: str, messages: list, options: dict, use_cache=False, retry_count=0, backoff_sec=RETRY_BACKOFF_SEC) -> PostQueryResults:
+    """
+    Ask for highlights with at most `retry_count` extra attempts:
+    - an answer that contains a broken JSON array gets a short repair prompt, for a stream the part read before it broke
+    - an answer that isn't an array at all is asked again in full
+    - a failed request is asked again in full after an exponential backoff
+    Clips mapped by failed attempts (eg. the highlights a stream closed before going off the rails) are kept.
+    Attempts are counted on the current span (`llm_attempts`, `llm_repairs`).
+    """
+    results: PostQueryResults = []
+    seen = set()
+    request = messages
+    for attempt in range(1, retry_count + 2):
+        tracer.count("llm_attempts")
+        try:
+            # only the first answer may come from the cache, a retry wants a new one
+            mapped, content, error = _ask_highlights(chuck, model_name, request, options, use_cache and attempt == 1)
+        except Exception as e:
+            mapped, content, error = [], "", f"request failed ({e})"
+            if attempt <= retry_count:
+                sleep(backoff_sec * 2 ** (attempt - 1))
+        for clip in mapped:
+            # a full re-ask after a cut off stream tends to return the same highlights again
+            if (clip[0]['start'], clip[-1]['end']) not in seen:
+                seen.add((clip[0]['start'], clip[-1]['end']))
+                results.append(clip)
+        if error is None:
+            break
+        if attempt > retry_count:
+            log(f"[ERR] query_with_retries: Giving up after {attempt} attempts ({error}), kept {len(results)} clips")
+            break
+
+        repairable = "[" in content and request is messages
+        request = _repair_messages(content) if repairable else messages
+        tracer.count("llm_repairs" if repairable else "llm_retries")
+        log(f"[+] Retry query: attempt {attempt + 1}/{retry_count + 1}, {'repairing the answer' if repairable else 'asking again'} ({error})")
+
+    if attempt > 1:
+        log(f"[+] query_with_retries: {len(results)} clips after {attempt} attempts")
+    return results
+
+
+def _chunk_messages(instructions: str, chuck: Clip) -> list:
+    raw_text = " ".join([seg['text'].lower() for seg in chuck])
+    return [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": f"```txt\n{raw_text}\n```"},
+    ]
 
 
 def query_clip_fulltext(chuck: Clip, model_name: str, options: dict, use_cache=False, retry_count = 0):
-    raw_text = " ".join([seg['text'].lower() for seg in chuck])
-    prompt = f"""
-    Your task is to identify impactful excerpts from the following text. 
-
-    - Extract short, self-contained excerpts of exactly 30 words that are emotionally engaging or convey a key insight. 
-    - These excerpts should be clear, attention-grabbing, and meaningful on their own.
-    - The excerpts should feel impactful, exciting, thought-provoking, or funny.
-
-    Return ONLY the excerpts in valid JSON format, like this:
-    ["excerpt 1", "excerpt 2", "excerpt 3"]
-
-    If no suitable excerpts exist, return [].
-
-    Text:
-    ```{raw_text}```
-    """ 
-    
-    
-    prompt = f"""
-    Your are given a chuck of the full context of a podcast.
-    Extract the top moments/pieces-of-text from this part, but make sure that:
-    - extract about 3 moment of loosely 30 words (doesn't need to be super strict) 
-    - each should be self-contained and something that stand out, something thats awesome, deep or relatable.
-
-    Return ONLY the excerpts in valid JSON format, like this:
-    ["That was so awesome because.. ", ""]
-
-    If no suitable excerpts exist, return [].
-
-    Text:
-    ```{raw_text}```
-    """ 
-
-    # 3 — Query LLM
-    timer.start("LLM")
-    content:str = ""
-    path_cache_current_prompt = f"{DIR_CACHE}/cached_output_{slugify(model_name, '')}_{slugify(raw_text[:20], '')}.txt"
-    if use_cache:
-        content = load_cache(path_cache_current_prompt)
-        if not content:
-            log('[ERR]: query. Failed to load cached, resume with prompt.')
-            
-    if not content:
-        chat_response = ollama.chat(
-            model=model_name,
-            messages=[
-                {"role": "system", "content": "You are an expert at identifying impactful excerpts from text."},
-                {"role": "user", "content": prompt}
-            ],
-            options=options
-        )
-        content = chat_response.message.content
-        save_cache(path_cache_current_prompt, content)
-        
-    log(f"[+] query_fulltext. Took {timer.end('LLM')} ({len(prompt)} chars)")
-    
-    def retry():
-        log(f"[+] Retry query: {retry_count}")
-        query_clip_fulltext(chuck, model_name, options, False, retry_count - 1)
-    
-    return fuzzy_parse_fullTexts(content, chuck, retry if retry_count != 0 and use_cache is True else None)
-
-    
-
+    return query_with_retries(chuck, model_name, _chunk_messages(PROMPT_FULLTEXT, chuck), context_options(model_name, options), use_cache, retry_count)
 
 
 def query_clip_trailer_fulltext(chuck: Clip, model_name: str, options: dict, use_cache=False, retry_count = 0):
-    raw_text = " ".join([seg['text'].lower() for seg in chuck])    
-    prompt = f"""
-    Your are given a chuck of the full context of a podcast. The goal is to create a trailer with different clips. 
-    Your tasks is to identify those clips out of a chuck of the full context.
-    
-    Extract the top moments/pieces-of-text from this part, but take these things into account
-    - extract about 3 moment of loosely 30-60 words. 
-    - each should be self-contained and something that stand out, be a punchline, an interesting question, a "waw" moment, something thats awesome, deep or feel relatable.
-    - remember that this is mean.
-
-    Return ONLY the excerpts in valid JSON format, like this:
-    ["Some time ago..", ".. when she knew."]
-
-    If no suitable excerpts exist, return an empty array [].
-
-    Your personal text chuck:
-    ```txt
-    {raw_text}
-    ```
-    """ 
-
-    # 3 — Query LLM
-    timer.start("LLM")
-    content:str = ""
-    path_cache_current_prompt = f"{DIR_CACHE}/cached_output_{slugify(model_name, '')}_{slugify(raw_text[:20], '')}.txt"
-    if use_cache:
-        content = load_cache(path_cache_current_prompt)
-        if not content:
-            print('[i]: query. No cached, resume with prompt.')
-            
-    if not content:
-        chat_response = ollama.chat(
-            model=model_name,
-            messages=[
-                {"role": "system", "content": "You are an expert at identifying impactful excerpts from text."},
-                {"role": "user", "content": prompt}
-            ],
-            options=options
-        )
-        content = chat_response.message.content
-        save_cache(path_cache_current_prompt, content)
-        
-    log(f"[+] query_fulltext. Took {timer.end('LLM')} ({len(prompt)} chars)")
-    
-    def retry():
-        log(f"[+] Retry query: {retry_count - 1}")
-        query_clip_fulltext(chuck, model_name, options, False, retry_count - 1)
-    
-    return fuzzy_parse_fullTexts(content, chuck, retry if retry_count != 0 and use_cache is True else None)
-
-    
-    
-    
-
+    return query_with_retries(chuck, model_name, _chunk_messages(PROMPT_TRAILER, chuck), context_options(model_name, options), use_cache, retry_count)
+
+
+def query_chunks(query_fn, chunks: AllClips, model_name: str, options: dict, use_cache=False, retry_count = 0, max_parallel=LLM_MAX_PARALLEL, pool: Optional[Executor] = None) -> List[PostQueryResults]:
+    """
+    Run `query_fn` (eg. `query_clip_trailer_fulltext`) over all chunks with at most `max_parallel` requests in flight.
+    Results are returned in chunk order, regardless of which request finishes first.
+    Pass a shared `pool` to bound the requests of several concurrent callers together (eg. batch runs).
+    """
+    results: List[PostQueryResults] = [[] for _ in chunks]
+    with nullcontext(pool) if pool else ThreadPoolExecutor(max_workers=max(1, max_parallel)) as pool:
+        futures = {
+            # run in the caller's context, so spans and log fields are attributed to the calling episode
+            pool.submit(copy_context().run, query_fn, chunk, model_name, options, use_cache, retry_count): i
+            for i, chunk in enumerate(chunks)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                log(f"[ERR] query_chunks: chuck {i+1}/{len(chunks)} failed ({e})")
+            log(f"[+] Processed chuck: {done}/{len(chunks)} (#{i+1})")
+    return results
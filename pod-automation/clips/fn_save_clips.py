@@ -1,31 +1,138 @@
-import json, subprocess, re
-from utils import PostQueryResults, log, timestamp_date
+import json, subprocess, re, os, tempfile, shutil
+from time import time
+from bisect import bisect_left, bisect_right
+from contextlib import nullcontext
+from concurrent.futures import Executor, ThreadPoolExecutor
+from utils import PostQueryResults, List, Word, Tuple, Optional, KeyframeIndex, log, timestamp_date, format_duration
 from utils import DIR_OUTPUT, FILE_METADATA
+from tracing import tracer
 
-def cut_and_save_clips(results: PostQueryResults, src_video_path: str, clip_file_name:str = ""):    
-    for i, clip in enumerate(results):
-        try:
-            start_time = clip[0]['start']
-            end_time = clip[-1]['end']
-            path_clip= f"{DIR_OUTPUT}/clip{str(i)}_{start_time:.0f}-_{end_time:.0f}_{clip_file_name}.mp4"
-            cut_clip(src_video_path, path_clip, start_time, end_time)
-        except Exception as e:
-            log(f"[ERR] Failed to cut clip [{str(i)}/{str(len(results))}]: {json.dumps(e)}")            
+# cutting engine, see `choose_cut_mode`
+CUT_MAX_PARALLEL = max(1, (os.cpu_count() or 2) // 2)
+SINGLE_PASS_MIN_CLIPS = 6
+SINGLE_PASS_MAX_BYTES = 4 * 1024 ** 3
 
+# (output path, start, end)
+CutJob = Tuple[str, float, float]
 
-    with open(FILE_METADATA, 'w') as f:
+
+def cut_and_save_clips(results: PostQueryResults, src_video_path: str, clip_file_name:str = "", output_dir:str = DIR_OUTPUT, mode="auto", keyframes: Optional[KeyframeIndex] = None, pool: Optional[Executor] = None):    
+    jobs = [(clip_path(clip, i, clip_file_name, output_dir), clip[0]['start'], clip[-1]['end']) for i, clip in enumerate(results) if len(clip)]
+    cut_clips(src_video_path, jobs, mode, keyframes, pool)
+    save_metadata(results, output_dir)
+
+
+def clip_path(clip: List[Word], i: int, clip_file_name:str = "", output_dir:str = DIR_OUTPUT) -> str:
+    return f"{output_dir}/clip{str(i)}_{clip[0]['start']:.0f}-_{clip[-1]['end']:.0f}_{clip_file_name}.mp4"
+
+
+def save_clip(clip: List[Word], i: int, src_video_path: str, clip_file_name:str = "", output_dir:str = DIR_OUTPUT, keyframes: Optional[KeyframeIndex] = None) -> Optional[str]:
+    """Cut a single clip (the i-th of the run) out of the source video, returns its path or None if cutting failed."""
+    try:
+        path = clip_path(clip, i, clip_file_name, output_dir)
+        cut_clip(src_video_path, path, clip[0]['start'], clip[-1]['end'], keyframes)
+        _count_cut(path)
+        return path
+    except Exception as e:
+        log(f"[ERR] Failed to cut clip [{str(i)}]: {e}")
+        return None
+
+
+def choose_cut_mode(src_video_path: str, clip_count: int, smart=False) -> str:
+    """
+    'single': one ffmpeg writes every clip, saving the process and probing overhead per clip, wins for many clips out of a modest file.
+    'parallel': one seeking ffmpeg per clip on a thread pool, wins for few clips or huge sources.
+    Smart cuts need a few ffmpeg calls per clip and always run 'parallel'.
+    """
+    if smart:
+        return "parallel"
+    size = os.path.getsize(src_video_path) if os.path.exists(src_video_path) else 0
+    if clip_count >= SINGLE_PASS_MIN_CLIPS and size <= SINGLE_PASS_MAX_BYTES:
+        return "single"
+    return "parallel"
+
+
+def cut_clips(src_video_path: str, jobs: List[CutJob], mode="auto", keyframes: Optional[KeyframeIndex] = None, pool: Optional[Executor] = None) -> List[float]:
+    """
+    Cut all `jobs` out of the source, returns the seconds spent per clip.
+    With a `keyframes` index the clips are frame accurate (smart cut), otherwise they snap to keyframes.
+    Pass a shared `pool` to bound the parallel cuts of several concurrent callers together (eg. batch runs).
+    """
+    if not jobs:
+        return []
+    if mode == "auto" or keyframes:
+        mode = choose_cut_mode(src_video_path, len(jobs), smart=bool(keyframes))
+    with tracer.span("cut_clips", mode=mode, smart=bool(keyframes)) as span:
+        timings = cut_clips_single_pass(src_video_path, jobs, pool) if mode == "single" else cut_clips_parallel(src_video_path, jobs, keyframes=keyframes, pool=pool)
+        for (path, start, end), seconds in zip(jobs, timings):
+            _count_cut(path)
+            log(f"[i] cut: {os.path.basename(path)} ({end - start:.0f}sec of video) took {seconds:.2f}sec")
+    log(f"[+] cut_clips: {len(jobs)} clips in {format_duration(span.elapsed)} (mode={mode}{', smart' if keyframes else ''})")
+    return timings
+
+
+def _count_cut(path: str) -> None:
+    if os.path.exists(path):
+        tracer.count("clips_cut")
+        tracer.count("bytes_written", os.path.getsize(path))
+
+
+def _timed_cut_clip(src_video_path: str, job: CutJob, keyframes: Optional[KeyframeIndex] = None) -> float:
+    started = time()
+    try:
+        cut_clip(src_video_path, *job, keyframes)
+    except Exception as e:
+        # the other clips are still cut, a failed one has no file
+        log(f"[ERR] Failed to cut clip '{os.path.basename(job[0])}': {e}")
+    return time() - started
+
+
+def cut_clips_parallel(src_video_path: str, jobs: List[CutJob], max_parallel=CUT_MAX_PARALLEL, keyframes: Optional[KeyframeIndex] = None, pool: Optional[Executor] = None) -> List[float]:
+    """
+    Every worker only waits on its ffmpeg process, so threads do: no forking of a process that is running the log
+    writer, LLM requests and transcription at the same time.
+    """
+    with nullcontext(pool) if pool else ThreadPoolExecutor(max_workers=min(max_parallel, len(jobs)), thread_name_prefix="cut") as pool:
+        return list(pool.map(_timed_cut_clip, [src_video_path] * len(jobs), jobs, [keyframes] * len(jobs)))
+
+
+def cut_clips_single_pass(src_video_path: str, jobs: List[CutJob], pool: Optional[Executor] = None) -> List[float]:
+    """
+    All clips from one ffmpeg invocation. Every clip is its own input, seeked on the input side like `cut_clip`,
+    so it starts on the keyframe before its start with audio and video in sync, exactly as a parallel cut would,
+    and only the clip ranges of the source are read. Only the first video and audio stream are kept, data and
+    subtitle streams of the source don't mux into mp4.
+    Per-clip timings are the shared pass divided evenly, as the clips are written simultaneously.
+    """
+    cmd = ["ffmpeg", "-y"]
+    for _, start, end in jobs:
+        cmd += ["-ss", str(start), "-t", str(end - start), "-i", src_video_path]
+    for i, (path, _, _) in enumerate(jobs):
+        cmd += ["-map", f"{i}:v:0", "-map", f"{i}:a:0?", "-c", "copy", "-avoid_negative_ts", "make_zero", path]
+    started = time()
+    try:
+        subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except Exception as e:
+        log(f"[ERR] cut_clips_single_pass: Failed, falling back to parallel cuts ({getattr(e, 'stderr', e)})")
+        return cut_clips_parallel(src_video_path, jobs, pool=pool)
+    return [(time() - started) / len(jobs)] * len(jobs)
+
+
+def save_metadata(results: PostQueryResults, output_dir:str = DIR_OUTPUT):
+    path_metadata = FILE_METADATA if output_dir == DIR_OUTPUT else f"{output_dir}/metadata.json"
+    with open(path_metadata, 'w') as f:
         # TODO:  PostQueryResults
         metadata_json = {
             'texts': [ " ".join([i['word'] for i in section]) for section in results],
             'clips': results,
         }
         json.dump(metadata_json, f, indent=2)
-    print(f"[i] Saved clips to: {DIR_OUTPUT}")
+    print(f"[i] Saved clips to: {output_dir}")
 
 
 
-def output_text(results: PostQueryResults, name:str):
-    out_path= f"{DIR_OUTPUT}/output_{name}.txt"
+def output_text(results: PostQueryResults, name:str, output_dir:str = DIR_OUTPUT):
+    out_path= f"{output_dir}/output_{name}.txt"
     with open(out_path, "w", encoding='utf-8') as f:
         # for words in results:
         #     start = words[0]['start']
@@ -34,7 +141,10 @@ def output_text(results: PostQueryResults, name:str):
         #     f.write(f"[{start:.2f} - {end:.2f}] {text}\n")
         json.dump(results, f,  ensure_ascii=False, indent=4)
                 
-def cut_clip(input_path: str, output_path: str, start: float, end: float):
+def cut_clip(input_path: str, output_path: str, start: float, end: float, keyframes: Optional[KeyframeIndex] = None):
+    """Raises if ffmpeg failed, no (partial) clip is left at `output_path` then."""
+    if keyframes:
+        return cut_clip_smart(input_path, output_path, start, end, keyframes)
     duration = end - start
     cmd = [
         "ffmpeg", "-y",
@@ -48,4 +158,146 @@ def cut_clip(input_path: str, output_path: str, start: float, end: float):
         subprocess.run(cmd, capture_output=True, text=True, check=True)
         # print(f"[i] Clip '{Path(output_path).name}' saved.")
     except Exception as e:
-        log(f"Error - Failed to cut video: {e.stderr}")
\ No newline at end of file
+        # `-y` may have left a partial file behind, which would pass for a finished clip
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise RuntimeError(f"Failed to cut video: {getattr(e, 'stderr', e)}") from e
+
+
+# encoders producing a stream that can be concatenated with a stream copy of the source
+SMART_CUT_ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+# mp4 sample entries that allow parameter sets in-band, the re-encoded edges keep their own SPS/PPS after the join
+SMART_CUT_TAGS = {"h264": "avc3", "hevc": "hev1"}
+# ffprobe profile name -> encoder `-profile:v`
+SMART_CUT_PROFILES = {
+    "h264": {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main", "High": "high", "High 10": "high10", "High 4:2:2": "high422", "High 4:4:4 Predictive": "high444"},
+    "hevc": {"Main": "main", "Main 10": "main10", "Main Still Picture": "mainstillpicture"},
+}
+AUDIO_ENCODERS = {"aac": "aac", "mp3": "libmp3lame", "opus": "libopus", "ac3": "ac3", "eac3": "eac3", "flac": "flac"}
+COLOR_OPTIONS = {"color_range": "-color_range", "color_space": "-colorspace", "color_transfer": "-color_trc", "color_primaries": "-color_primaries"}
+
+
+def _video_encoder_args(keyframes: KeyframeIndex) -> List[str]:
+    """Encoder settings matching the source stream (profile, level, pixel format, colors), from its ffprobe fields."""
+    codec = keyframes['codec']
+    video = keyframes.get('video') or {}
+    args = ["-c:v", SMART_CUT_ENCODERS.get(codec, "libx264"), "-preset", "veryfast", "-crf", "18"]
+    if keyframes['pix_fmt']:
+        args += ["-pix_fmt", keyframes['pix_fmt']]
+    profile = SMART_CUT_PROFILES.get(codec, {}).get(video.get("profile"))
+    if profile:
+        args += ["-profile:v", profile]
+    level = video.get("level") or 0
+    if level > 0 and codec == "h264":
+        # ffprobe reports h264 levels times 10 (40 = 4.0)
+        args += ["-level:v", f"{level / 10:g}"]
+    elif level > 0 and codec == "hevc":
+        # and hevc levels times 30 (120 = 4.0)
+        args += ["-x265-params", f"level-idc={level / 30:g}"]
+    for field, option in COLOR_OPTIONS.items():
+        if video.get(field) not in (None, "", "unknown"):
+            args += [option, video[field]]
+    return args
+
+
+def _audio_encoder_args(keyframes: KeyframeIndex) -> List[str]:
+    audio = keyframes.get('audio') or {}
+    if not audio:
+        return ["-an"]
+    args = ["-c:a", AUDIO_ENCODERS.get(audio.get("codec_name"), "aac")]
+    if audio.get("sample_rate"):
+        args += ["-ar", str(audio["sample_rate"])]
+    if audio.get("channels"):
+        args += ["-ac", str(audio["channels"])]
+    if str(audio.get("bit_rate", "")).isdigit():
+        args += ["-b:a", str(audio["bit_rate"])]
+    return args
+
+
+def _timescale_args(keyframes: KeyframeIndex) -> List[str]:
+    """The source's video timebase (eg. 1/15360) for the output track, so the copied middle keeps its timestamps exact."""
+    _, _, timescale = str((keyframes.get('video') or {}).get("time_base", "")).partition("/")
+    return ["-video_track_timescale", timescale] if timescale.isdigit() else []
+
+
+def _encode_part(input_path: str, output_path: str, start: float, end: float, keyframes: KeyframeIndex, with_audio=True):
+    cmd = [
+        "ffmpeg", "-y",
+        "-ss", str(start),
+        "-i", input_path,
+        "-t", str(end - start),
+        "-map", "0:v:0", *(["-map", "0:a:0?"] if with_audio else []),
+        *_video_encoder_args(keyframes),
+        *(_audio_encoder_args(keyframes) if with_audio else ["-an"]),
+        *(_timescale_args(keyframes) if output_path.endswith(".mp4") else []),
+        "-avoid_negative_ts", "make_zero",
+        output_path
+    ]
+    subprocess.run(cmd, capture_output=True, text=True, check=True)
+
+
+def _copy_part(input_path: str, output_path: str, start: float, end: float):
+    cmd = [
+        "ffmpeg", "-y",
+        "-ss", str(start),
+        "-i", input_path,
+        "-t", str(end - start),
+        "-map", "0:v:0", "-an",
+        "-c", "copy",
+        "-avoid_negative_ts", "make_zero",
+        output_path
+    ]
+    subprocess.run(cmd, capture_output=True, text=True, check=True)
+
+
+def cut_clip_smart(input_path: str, output_path: str, start: float, end: float, keyframes: KeyframeIndex):
+    """
+    Frame accurate cut at close to stream copy speed: only the partial GOPs at both edges are re-encoded,
+    everything between the first and last keyframe inside the clip is stream copied, then all parts are concatenated.
+    - the edges are encoded with the source stream's profile, level, pixel format and colors
+    - video parts are MPEG-TS, so every part carries its own SPS/PPS in-band into the joined stream (avc3/hev1)
+    - audio isn't joined at all, it is encoded once for the whole clip with the source's rate, channels and bitrate
+    Falls back to a plain `cut_clip` when ffmpeg fails, and raises like it if that fails too.
+    """
+    times = keyframes['keyframes']
+    i_first = bisect_left(times, start)
+    i_last = bisect_right(times, end) - 1
+    first_kf = times[i_first] if i_first < len(times) else None
+    last_kf = times[i_last] if i_last >= 0 else None
+
+    tmp_dir = tempfile.mkdtemp(prefix="smartcut_")
+    try:
+        if keyframes['codec'] not in SMART_CUT_ENCODERS or first_kf is None or last_kf is None or first_kf >= last_kf:
+            # no copyable GOP inside the clip, a plain accurate re-encode is as fast
+            _encode_part(input_path, output_path, start, end, keyframes)
+            return
+
+        parts = []
+        if first_kf - start > 0.01:
+            parts.append(f"{tmp_dir}/head.ts")
+            _encode_part(input_path, parts[-1], start, first_kf, keyframes, with_audio=False)
+        parts.append(f"{tmp_dir}/middle.ts")
+        _copy_part(input_path, parts[-1], first_kf, last_kf)
+        if end - last_kf > 0.01:
+            parts.append(f"{tmp_dir}/tail.ts")
+            _encode_part(input_path, parts[-1], last_kf, end, keyframes, with_audio=False)
+
+        path_list = f"{tmp_dir}/parts.txt"
+        with open(path_list, 'w') as f:
+            f.writelines(f"file '{part}'\n" for part in parts)
+        cmd = [
+            "ffmpeg", "-y",
+            "-f", "concat", "-safe", "0", "-i", path_list,
+            "-ss", str(start), "-t", str(end - start), "-i", input_path,
+            "-map", "0:v:0", "-map", "1:a:0?",
+            "-c:v", "copy", "-tag:v", SMART_CUT_TAGS[keyframes['codec']],
+            *_audio_encoder_args(keyframes),
+            *_timescale_args(keyframes),
+            output_path
+        ]
+        subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except Exception as e:
+        log(f"[ERR] Failed to smart cut video, falling back to a keyframe cut: {getattr(e, 'stderr', e)}")
+        cut_clip(input_path, output_path, start, end)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -1,27 +1,140 @@
-import whisperx, os
+import os
+from time import perf_counter
 
-from utils import load_cache, save_cache, timer, log
-from utils import Transcript
+from utils import load_cache, log, format_duration
+from utils import Transcript, Segment, Iterator
 from utils import DIR_PROJECT, DIR_CACHE, DIR_OUTPUT
+from utils import Optional
+from models import load_asr_model, load_align_model
+from transcript_store import ColumnarTranscript
+from tracing import tracer
+from audio_cache import load_audio, SAMPLE_RATE
 
-def transcribe_with_whisperx(video_path:str, guest_name:str, use_cache=False) -> Transcript:
-    path_transcript= f"{DIR_CACHE}/{guest_name}.json"
+# consecutive streaming windows share this much audio, so speech on a window edge is heard whole by one of them
+WINDOW_OVERLAP_SEC = 30
 
-    if use_cache and os.path.exists(path_transcript):
+
+def load_cached_transcript(guest_name:str) -> Optional[ColumnarTranscript]:
+    """Memory-mapped cached transcript, older JSON caches are converted on first load."""
+    path_bundle = f"{DIR_CACHE}/{guest_name}.transcript"
+    if os.path.isdir(path_bundle):
+        return ColumnarTranscript.load(path_bundle)
+    path_json = f"{DIR_CACHE}/{guest_name}.json"
+    if os.path.exists(path_json):
+        transcript = ColumnarTranscript.from_transcript(load_cache(path_json))
+        transcript.save(path_bundle)
+        return transcript
+    return None
+
+
+def save_transcript(guest_name:str, transcription) -> ColumnarTranscript:
+    """Accepts a `Transcript` or an already columnar one (eg. after adding speaker labels), returns the columnar one."""
+    if not isinstance(transcription, ColumnarTranscript):
+        transcription = ColumnarTranscript.from_transcript(transcription)
+    transcription.save(f"{DIR_CACHE}/{guest_name}.transcript")
+    return transcription
+
+
+def transcribe_with_whisperx(video_path:str, guest_name:str, use_cache=False) -> ColumnarTranscript:
+    """The aligned transcript, as the same (columnar, dict compatible) type whether it was cached or just made."""
+    cached = load_cached_transcript(guest_name) if use_cache else None
+    if cached is not None:
         log(f"[+] Using cached 'transcript'")
-        return load_cache(path_transcript)
-
-    timer.start('T')
-    log(f"[+] Starting transcribing video: '{video_path}'...")
-    model = whisperx.load_model("small.en", device="cpu", compute_type="int8")
-    audio = whisperx.load_audio(video_path)
-    transcription = model.transcribe(audio, batch_size=16, language="en")
-
-    log(f"[+] Performing transcription word-level alignment (transcribe took {timer.get('T')})...")
-    model_a, metadata = whisperx.load_align_model(language_code='en', device="cpu")
-    transcription = whisperx.align(transcription["segments"], model_a, metadata, audio, device="cpu")
-    
-    save_cache(path_transcript, transcription)
+        return cached
+
+    # whisperx (and torch) only load when there is something to transcribe
+    import whisperx
+    with tracer.span("transcribe", video=video_path) as span:
+        log(f"[+] Starting transcribing video: '{video_path}'...")
+        model = load_asr_model("small.en", device="cpu", compute_type="int8")
+        audio = load_audio(video_path)
+        transcription = model.transcribe(audio, batch_size=16, language="en")
+        tracer.count("audio_sec", len(audio) / SAMPLE_RATE)
+
+        log(f"[+] Performing transcription word-level alignment (transcribe took {format_duration(span.elapsed)})...")
+        with tracer.span("align"):
+            model_a, metadata = load_align_model('en', device="cpu")
+            transcription = whisperx.align(transcription["segments"], model_a, metadata, audio, device="cpu")
+
+        transcription = save_transcript(guest_name, transcription)
     total_duration = transcription['segments'][-1]['end'] - transcription["segments"][0]["start"]
-    log(f"[+] Transcript finished in {timer.end('T')}. Total video duration: {total_duration}")
-    return transcription
\ No newline at end of file
+    log(f"[+] Transcript finished in {format_duration(span.elapsed)}. Total video duration: {total_duration}")
+    return transcription
+
+
+def _new_words(seg: Segment, emitted_until: float) -> Optional[Segment]:
+    """`seg` without the words an earlier window already covered (by timestamp), None if nothing is left."""
+    words = [w for w in seg['words'] if w.get('start', seg['start']) >= emitted_until]
+    if len(words) == len(seg['words']):
+        return seg
+    if not words:
+        return None
+    seg['words'] = words
+    seg['start'] = next((w['start'] for w in words if 'start' in w), seg['start'])
+    seg['text'] = " ".join(w['word'] for w in words)
+    return seg
+
+
+def transcribe_stream(video_path:str, guest_name:str, use_cache=False, window_minutes=5, overlap_sec=WINDOW_OVERLAP_SEC) -> Iterator[Segment]:
+    """
+    Streaming variant of `transcribe_with_whisperx`: transcribes and aligns the audio in windows of `window_minutes`
+    and yields the aligned segments of each window right away. The full transcript is cached once done.
+    Windows overlap by `overlap_sec`. A window leaves the segments that start inside the next window and run past the
+    middle of their overlap to that next window, which heard all of it. Segments that started before the next window
+    are always yielded by this one, and words the previous window already yielded are dropped by timestamp.
+    """
+    cached = load_cached_transcript(guest_name) if use_cache else None
+    if cached is not None:
+        log(f"[+] Using cached 'transcript'")
+        yield from cached['segments']
+        return
+
+    import whisperx
+    started = perf_counter()
+    log(f"[+] Starting streaming transcription of video: '{video_path}'...")
+    # spans never stay open across a `yield`, the consumer's work would be attributed to them
+    with tracer.span("load_audio", video=video_path):
+        model = load_asr_model("small.en", device="cpu", compute_type="int8")
+        model_a, metadata = load_align_model('en', device="cpu")
+        audio = load_audio(video_path)
+
+    window = window_minutes * 60 * SAMPLE_RATE
+    overlap = min(int(overlap_sec * SAMPLE_RATE), window // 2)
+    transcription: Transcript = {"segments": [], "word_segments": []}
+    emitted_until = 0.0
+    for offset in range(0, len(audio), window - overlap):
+        audio_window = audio[offset:offset + window]
+        last = offset + window >= len(audio)
+        with tracer.span("transcribe", offset_sec=offset / SAMPLE_RATE):
+            result = model.transcribe(audio_window, batch_size=16, language="en")
+            tracer.count("audio_sec", len(audio_window) / SAMPLE_RATE)
+        with tracer.span("align", offset_sec=offset / SAMPLE_RATE):
+            result = whisperx.align(result["segments"], model_a, metadata, audio_window, device="cpu")
+
+        shift = offset / SAMPLE_RATE
+        next_start = (offset + window - overlap) / SAMPLE_RATE
+        handover = (offset + window - overlap // 2) / SAMPLE_RATE
+        for seg in result["segments"]:
+            seg['start'] += shift
+            seg['end'] += shift
+            for word in seg['words']:
+                if 'start' in word:
+                    word['start'] += shift
+                    word['end'] += shift
+            if not last and seg['start'] >= next_start and seg['end'] > handover:
+                # runs into the overlap, the next window has it whole. One that started earlier is only partly in the
+                # next window, deferring it would lose its first words
+                break
+            seg = _new_words(seg, emitted_until)
+            if seg is None:
+                continue
+            emitted_until = seg['end']
+            transcription["segments"].append(seg)
+            transcription["word_segments"].extend(seg['words'])
+            yield seg
+        log(f"[+] Transcribed {(offset + len(audio_window)) / SAMPLE_RATE / 60:.0f}/{len(audio) / SAMPLE_RATE / 60:.0f}min ({format_duration(perf_counter() - started)})")
+        if last:
+            break
+
+    save_transcript(guest_name, transcription)
+    log(f"[+] Streaming transcript finished in {format_duration(perf_counter() - started)}")
@@ -0,0 +1,127 @@
+"""
+
+Content-addressed LLM response cache.
+Responses are keyed by a hash of (model, messages, options) and stored in a single sqlite file,
+bounded by entry count, total size and age (least recently used entries go first).
+
+"""
+import sqlite3, hashlib, json, threading
+from time import time
+from typing import Optional
+from utils import log
+from utils import DIR_CACHE
+
+FILE_LLM_CACHE = f"{DIR_CACHE}/llm_cache.sqlite"
+
+
+def cache_key(model_name: str, messages: list, options: Optional[dict] = None) -> str:
+    """Stable hash of everything that influences the model output."""
+    payload = json.dumps({"model": model_name, "messages": messages, "options": options or {}}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: str = FILE_LLM_CACHE, max_entries=5000, max_bytes=200 * 1024 * 1024, max_age_days=90):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                content TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed)")
+        self._db.commit()
+        self.evict()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT content, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or time() - row[1] > self.max_age_sec:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time(), key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, model_name: str, content: str) -> None:
+        now = time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, content, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, content, len(content.encode("utf-8")), now, now),
+            )
+            self._db.commit()
+        self.evict()
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones until within the count and size bounds."""
+        with self._lock:
+            removed = self._db.execute("DELETE FROM responses WHERE created < ?", (time() - self.max_age_sec,)).rowcount
+            count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if count > self.max_entries or total > self.max_bytes:
+                rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed ASC").fetchall()
+                stale = []
+                for key, size in rows:
+                    if count <= self.max_entries and total <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    count -= 1
+                    total -= size
+                self._db.executemany("DELETE FROM responses WHERE key = ?", stale)
+                removed += len(stale)
+            self._db.commit()
+        return removed
+
+    def stats(self) -> str:
+        with self._lock:
+            count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return f"hits={self.hits}, misses={self.misses}, entries={count}, size={total / 1024:.0f}KB"
+
+
+_llm_cache: Optional[LLMCache] = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """The shared cache, opened (and evicted) on first use rather than on import."""
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMCache()
+        return _llm_cache
+
+
+def set_llm_cache(cache: LLMCache) -> None:
+    global _llm_cache
+    with _llm_cache_lock:
+        _llm_cache = cache
+
+
+def cached_chat(chat, model_name: str, messages: list, options: dict, use_cache=False) -> str:
+    """
+    Return the content of `chat(model, messages, options)`, served from the LLM cache when `use_cache` is set.
+    Fresh responses are always stored, so a later cached run can reuse them.
+    """
+    llm_cache = get_llm_cache()
+    key = cache_key(model_name, messages, options)
+    if use_cache:
+        content = llm_cache.get(key)
+        if content is not None:
+            return content
+        log(f"[i] llm_cache: miss for {model_name} ({key[:10]}), resume with prompt.")
+
+    content = chat(model_name, messages, options)
+    llm_cache.set(key, model_name, content)
+    return content
@@ -0,0 +1,104 @@
+"""
+
+Ollama compatible stand-in server (`/api/chat`, streaming included) backed by an `llm_transport` transport,
+to run the pipeline against recorded or synthetic answers with a realistic latency and generation speed.
+
+Usage:
+    python llm_standin.py [--replay recording.jsonl] [--synthetic] [--latency 0.2] [--tokens-per-sec 40] [--port 11435]
+    OLLAMA_HOST=http://127.0.0.1:11435 python main.py
+
+"""
+import json, threading, argparse
+from itertools import chain
+from time import strftime, gmtime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils import log
+from llm_transport import LLMTransport, ReplayTransport, ChatResponse, synthetic_responder
+
+DEFAULT_STANDIN_PORT = 11435
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    transport: LLMTransport = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload: dict, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            return self._send_json({"version": "0.0.0-standin"})
+        if self.path == "/api/tags":
+            return self._send_json({"models": []})
+        self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if self.path != "/api/chat":
+            return self._send_json({"error": "not found"}, 404)
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        args = (request["model"], request["messages"], request.get("options"), request.get("format") or None)
+        base = {"model": request["model"], "created_at": strftime("%Y-%m-%dT%H:%M:%SZ", gmtime())}
+        try:
+            if not request.get("stream", True):
+                resp = self.transport.chat(*args)
+                return self._send_json({**base, **self._message(resp)})
+            pieces = self.transport.stream(*args)
+            first = next(pieces)
+        except KeyError as e:
+            return self._send_json({"error": str(e)}, 404)
+
+        # ollama's NDJSON stream, each piece is written as soon as the transport yields it
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for piece in chain([first], pieces):
+                data = (json.dumps({**base, **self._message(piece)}) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # the client aborted, stop generating
+            pieces.close()
+
+    @staticmethod
+    def _message(resp: ChatResponse) -> dict:
+        message = {"message": {"role": "assistant", "content": resp.content}, "done": resp.done}
+        if resp.done:
+            message.update({k: v for k, v in resp.to_dict().items() if k not in ("content", "done")}, done_reason="stop")
+        return message
+
+
+def serve(transport: LLMTransport, host="127.0.0.1", port=DEFAULT_STANDIN_PORT) -> ThreadingHTTPServer:
+    """Start an ollama compatible server backed by `transport` in a background thread, `.shutdown()` to stop."""
+    handler = type("StandInHandler", (_StandInHandler,), {"transport": transport})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="llm-standin", daemon=True).start()
+    log(f"[+] LLM stand-in serving on http://{host}:{server.server_port}")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ollama compatible stand-in server")
+    parser.add_argument("--replay", help="JSONL recording made with CLIPS_LLM_TRANSPORT=record:<file>")
+    parser.add_argument("--synthetic", action="store_true", help="answer unrecorded requests with deterministic synthetic responses")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--tokens-per-sec", type=float, default=None, help="pace answers at this generation speed")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_STANDIN_PORT)
+    args = parser.parse_args()
+    assert args.replay or args.synthetic, "Pass --replay <file> and/or --synthetic"
+    server = serve(ReplayTransport(args.replay, synthetic_responder() if args.synthetic else None, args.latency, args.tokens_per_sec), args.host, args.port)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
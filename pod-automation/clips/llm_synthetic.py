@@ -0,0 +1,39 @@
+"""
+
+Deterministic offline LLM answers, for the `synthetic` transport, the `llm_standin` server and the benchmarks.
+- highlight prompts get 3 verbatim excerpts of the fenced chunk text, picked by a seed derived from that text
+- batched relevance prompts get a JSON object of clip number -> "YES"/"NO", single ones a "YES"/"NO"
+Same prompt, same answer, so runs are comparable between versions.
+
+"""
+import re, json, random, zlib
+
+HIGHLIGHTS_PER_CHUNK = 3
+HIGHLIGHT_WORDS = 45
+
+_FENCED = re.compile(r"```(?:txt)?\s*(.*?)\s*```", re.S)
+_NUMBERED = re.compile(r"^(\d+)\. `(.*)`$", re.M)
+
+
+def _seed(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+def _decide(text: str) -> str:
+    return "YES" if _seed(text) % 3 else "NO"
+
+
+def answer(prompt: str) -> str:
+    numbered = _NUMBERED.findall(prompt)
+    if numbered:
+        return json.dumps({number: _decide(text) for number, text in numbered})
+    if "Clip:" in prompt:
+        return _decide(prompt.rsplit("Clip:", 1)[1])
+
+    fenced = _FENCED.findall(prompt)
+    words = (fenced[-1] if fenced else prompt).split()
+    if len(words) <= HIGHLIGHT_WORDS:
+        return "[]"
+    rnd = random.Random(_seed(" ".join(words)))
+    starts = sorted(rnd.randrange(0, len(words) - HIGHLIGHT_WORDS) for _ in range(HIGHLIGHTS_PER_CHUNK))
+    return json.dumps([" ".join(words[s:s + HIGHLIGHT_WORDS]) for s in starts])
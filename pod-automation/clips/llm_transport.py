@@ -0,0 +1,205 @@
+"""
+
+Pluggable LLM transport, everything that talks to a model goes through `get_transport().chat(...)` / `.stream(...)`.
+- `OllamaTransport`: the real ollama client (optionally against another host)
+- `RecordingTransport`: wraps another transport and appends every request/response pair to a JSONL file
+- `ReplayTransport`: answers from a recording and/or a synthetic responder, with simulated latency and tokens/sec
+`llm_standin` serves a transport as an ollama compatible server, so the unmodified client can be pointed at it.
+
+The default transport is picked from `CLIPS_LLM_TRANSPORT`:
+    ollama (default) | record:<file.jsonl> | replay:<file.jsonl> | synthetic
+
+"""
+import os, json, threading
+from abc import ABC, abstractmethod
+from time import sleep, perf_counter
+from utils import log
+from utils import Optional, Callable, Iterator, List
+from utils import LLM_KEEP_ALIVE
+from llm_cache import cache_key
+from fn_chuck import estimate_tokens, context_options
+
+
+class ChatResponse:
+    """The parts of an ollama chat response the pipeline uses, durations in nanoseconds like ollama reports them."""
+    def __init__(self, content: str, prompt_eval_count=0, eval_count=0, prompt_eval_duration=0, eval_duration=0, total_duration=0, load_duration=0, done=True):
+        self.content = content
+        self.done = done
+        self.prompt_eval_count = prompt_eval_count
+        self.eval_count = eval_count
+        self.prompt_eval_duration = prompt_eval_duration
+        self.eval_duration = eval_duration
+        self.total_duration = total_duration
+        self.load_duration = load_duration
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class LLMTransport(ABC):
+    @abstractmethod
+    def chat(self, model: str, messages: list, options: Optional[dict] = None, format: Optional[str] = None) -> ChatResponse:
+        """The complete answer, with the stats."""
+
+    def stream(self, model: str, messages: list, options: Optional[dict] = None, format: Optional[str] = None) -> Iterator[ChatResponse]:
+        """
+        Yield the answer in pieces as it is generated, the last piece has `done` set and carries the stats.
+        Closing the iterator early aborts the generation.
+        """
+        yield self.chat(model, messages, options, format)
+
+
+class OllamaTransport(LLMTransport):
+    """
+    Requests always carry `keep_alive` and the model's `num_ctx`: a differing context size makes ollama reload the
+    model, and a resident model keeps the KV cache of the shared prompt prefix between chunk queries.
+    """
+    def __init__(self, host: Optional[str] = None, keep_alive: str = LLM_KEEP_ALIVE):
+        import ollama
+        self._client = ollama.Client(host=host) if host else ollama
+        self.keep_alive = keep_alive
+
+    def _request(self, model, messages, options, format) -> dict:
+        return {"model": model, "messages": messages, "options": context_options(model, options), "format": format, "keep_alive": self.keep_alive}
+
+    def chat(self, model, messages, options=None, format=None) -> ChatResponse:
+        return self._convert(self._client.chat(**self._request(model, messages, options, format)))
+
+    def stream(self, model, messages, options=None, format=None) -> Iterator[ChatResponse]:
+        parts = self._client.chat(**self._request(model, messages, options, format), stream=True)
+        try:
+            for part in parts:
+                yield self._convert(part)
+        finally:
+            # drops the HTTP response, which makes the server stop generating
+            getattr(parts, "close", lambda: None)()
+
+    @staticmethod
+    def _convert(resp) -> ChatResponse:
+        return ChatResponse(
+            resp.message.content,
+            **{field: getattr(resp, field, None) or 0 for field in ("prompt_eval_count", "eval_count", "prompt_eval_duration", "eval_duration", "total_duration", "load_duration")},
+            done=bool(getattr(resp, "done", True)),
+        )
+
+
+def request_key(model: str, messages: list, options: Optional[dict] = None, format: Optional[str] = None) -> str:
+    return cache_key(model, messages, {"options": options or {}, "format": format})
+
+
+class RecordingTransport(LLMTransport):
+    def __init__(self, inner: LLMTransport, path: str):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+
+    def chat(self, model, messages, options=None, format=None) -> ChatResponse:
+        resp = self.inner.chat(model, messages, options, format)
+        self._record(model, messages, options, format, resp)
+        return resp
+
+    def stream(self, model, messages, options=None, format=None) -> Iterator[ChatResponse]:
+        # only complete answers are recorded, an aborted stream isn't what the model would have answered
+        pieces = []
+        for piece in self.inner.stream(model, messages, options, format):
+            pieces.append(piece.content)
+            yield piece
+            if piece.done:
+                self._record(model, messages, options, format, ChatResponse(**{**piece.to_dict(), "content": "".join(pieces)}))
+
+    def _record(self, model, messages, options, format, resp: ChatResponse) -> None:
+        record = {"key": request_key(model, messages, options, format), "model": model, "messages": messages, "options": options, "format": format, "response": resp.to_dict()}
+        with self._lock, open(self.path, 'a') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+class ReplayTransport(LLMTransport):
+    """
+    Serve recorded responses, requests that weren't recorded go to `responder(prompt) -> content` (or raise KeyError).
+    `latency` is added per request and the answer is paced at `tokens_per_sec`, to mimic a real server.
+    """
+    def __init__(self, path: Optional[str] = None, responder: Optional[Callable[[str], str]] = None, latency=0.0, tokens_per_sec: Optional[float] = None):
+        self.responder = responder
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.recorded: dict[str, dict] = {}
+        if path:
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.recorded[record["key"]] = record["response"]
+
+    def _respond(self, model, messages, options, format) -> ChatResponse:
+        recorded = self.recorded.get(request_key(model, messages, options, format))
+        if recorded is not None:
+            return ChatResponse(**recorded)
+        if self.responder is not None:
+            content = self.responder(messages[-1]["content"])
+            return ChatResponse(content, estimate_tokens("".join(m["content"] for m in messages)), estimate_tokens(content))
+        raise KeyError(f"ReplayTransport: no recorded response for this {model} request")
+
+    def _timed(self, resp: ChatResponse, started: float) -> ChatResponse:
+        if self.latency or self.tokens_per_sec:
+            resp.prompt_eval_duration = int(self.latency * 1e9)
+            resp.eval_duration = int((perf_counter() - started - self.latency) * 1e9)
+            resp.total_duration = int((perf_counter() - started) * 1e9)
+        return resp
+
+    def chat(self, model, messages, options=None, format=None) -> ChatResponse:
+        started = perf_counter()
+        resp = self._respond(model, messages, options, format)
+        sleep(self.latency + (resp.eval_count / self.tokens_per_sec if self.tokens_per_sec else 0.0))
+        return self._timed(resp, started)
+
+    def stream(self, model, messages, options=None, format=None) -> Iterator[ChatResponse]:
+        started = perf_counter()
+        resp = self._respond(model, messages, options, format)
+        sleep(self.latency)
+        pieces = _pieces(resp.content)
+        per_piece = resp.eval_count / self.tokens_per_sec / len(pieces) if self.tokens_per_sec else 0.0
+        for piece in pieces:
+            sleep(per_piece)
+            yield ChatResponse(piece, done=False)
+        yield self._timed(ChatResponse(**{**resp.to_dict(), "content": ""}), started)
+
+
+def synthetic_responder() -> Callable[[str], str]:
+    from llm_synthetic import answer
+    return answer
+
+
+def transport_from_env(spec: Optional[str] = None) -> LLMTransport:
+    spec = spec or os.environ.get("CLIPS_LLM_TRANSPORT", "ollama")
+    kind, _, path = spec.partition(":")
+    if kind == "ollama":
+        return OllamaTransport()
+    if kind == "record":
+        return RecordingTransport(OllamaTransport(), path)
+    if kind == "replay":
+        return ReplayTransport(path)
+    if kind == "synthetic":
+        return ReplayTransport(responder=synthetic_responder())
+    raise ValueError(f"Unknown CLIPS_LLM_TRANSPORT: '{spec}'")
+
+
+_transport: Optional[LLMTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> LLMTransport:
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = transport_from_env()
+        return _transport
+
+
+def set_transport(transport: LLMTransport) -> None:
+    global _transport
+    with _transport_lock:
+        _transport = transport
+
+
+def _pieces(content: str, size=4) -> List[str]:
+    return [content[i:i + size] for i in range(0, len(content), size)] or [""]
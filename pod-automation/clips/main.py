@@ -4,78 +4,125 @@
 
 
 
-import os, sys
+import os, sys, argparse
 from pathlib import Path
-from utils import log, timer, slugify, boot_ollama, save_cache
-from utils import DIR_PROJECT, LLM_OPTIONS
+from itertools import count
+from utils import log, log_context, flush_logs, slugify, boot_ollama, save_cache, format_duration
+from utils import DIR_PROJECT, DIR_OUTPUT, LLM_OPTIONS, LLM_MAX_PARALLEL
+from utils import MODEL_NAME, USE_CACHED_TRANSCRIPTION, USE_CACHED_LLM_OUTPUT, USE_SMART_CUT
 from utils import List, PostQueryResults
 
-from fn_chuck import chunk_by_time
-from fn_query import query_clip_fulltext, query_clip_trailer_fulltext
-from fn_save_clips import cut_and_save_clips, output_text
-from fn_transcribe import transcribe_with_whisperx
-from fn_post_processing import post_clean_obvious_clips, post_query_filter_relevant_clip
+from fn_chuck import chunk_by_tokens, token_budget
+from fn_query import query_clip_trailer_fulltext, PROMPT_TRAILER
+from fn_save_clips import save_clip, save_metadata, output_text
+from fn_transcribe import transcribe_stream
+from fn_diarize import start_diarization, finish_diarization, is_diarized
+from fn_keyframes import load_keyframe_index
+from fn_post_processing import post_clean_obvious_clips, RelevanceBatcher, StreamingDedup
+from llm_cache import get_llm_cache
+from pipeline import run_pipeline, stage
+from run_manifest import RunManifest
+from tracing import tracer, format_usage
 
 
-# -------- Configs -------- #
-
-MODEL_NAME = "llama3" # no-long-context, mehmeh-quality
-# MODEL_NAME = "qwen2.5:7b-instruct-q4_K_M" # meh-quality-clips
-MODEL_NAME = "yi:9b-chat-v1.5-q6_K" # +long context, meh_ok-quality, 
-# MODEL_NAME = "spooknik/hermes-2-pro-mistral-7b:q8" # ..
-# MODEL_NAME = "qwen3:4b-thinking-2507-fp16" # insanely slo, but has thinking output which we don't want
-
-
-
-
-# TRY: MythoMax-L2
-# TRY?: OpenChat 3.6
-
-# -uncensored
-
 # ------- variable config ------- #
 arg_video_path=f'{DIR_PROJECT}/pod car dude.mp4'
 arg_video_path=f'{DIR_PROJECT}/pod mark Coleman.mp4'
 
-use_cached_transcription=True # won't redo transcribe  sys.argv[1]
-used_cached_llm_output=False # won't redo prompts (only useful if you are testing postprocessing)
+# the model and cache/cut settings are in utils, shared with batch.py
+use_diarization=False # label the cached transcript with speakers, runs in a parallel process (needs a HuggingFace token for pyannote)
 
 guest_name=Path(arg_video_path).name.split('.mp4')[0] or "Unknown Guest"
 
-def main():
+def main(resume=False, diarize=use_diarization):
     assert os.path.exists(arg_video_path), f"File not found: {arg_video_path}"
     boot_ollama()
     log('', 2)
-    log(f"Start='{guest_name}', Model='{MODEL_NAME}', cache_transcript={str(use_cached_transcription)}, cache_llm_output={str(used_cached_llm_output)} ")
-    timer.start('@')
-    # Step 1 — transcribe video
-    transcription = transcribe_with_whisperx(arg_video_path, guest_name, use_cached_transcription)
-    # word_segments = transcription['word_segments']
-    segments = transcription['segments']
-    
-    
-    # Step 2 — Query the chunks
-    all_results: PostQueryResults = []
-    chunks = chunk_by_time(segments, minutes=5)
-    for i, chunk in enumerate(chunks):
-        log(f"[+] Processing chuck: {i+1}/{len(chunks)}")
-        results = query_clip_trailer_fulltext(chunk, MODEL_NAME, LLM_OPTIONS['best_b'], used_cached_llm_output, 3)
-        all_results.extend(results)
-
-    save_cache('./all_results.json', all_results)
-    # Step 3 — Post process output (middlewares)
-    post_results = post_clean_obvious_clips(all_results)
-    # post_results = post_rank_top(all_results, 10)
-    post_results = post_query_filter_relevant_clip(post_results)
-
-    # Step 4 — Output results
-    output_text(post_results, slugify(MODEL_NAME, ''))
-    cut_and_save_clips(post_results, arg_video_path, slugify(f"{MODEL_NAME}_{guest_name}", ''))
-    print(f"[v] Finished cut! Duration: {timer.end('@')}")
+    log(f"Start='{guest_name}', Model='{MODEL_NAME}', cache_transcript={str(USE_CACHED_TRANSCRIPTION)}, cache_llm_output={str(USE_CACHED_LLM_OUTPUT)} ")
+    with log_context(episode=guest_name), tracer.span("run", guest=guest_name, model=MODEL_NAME) as run:
+        clip_file_name = slugify(f"{MODEL_NAME}_{guest_name}", '')
+        keyframes = load_keyframe_index(arg_video_path, guest_name) if USE_SMART_CUT else None
+
+        # every finished chunk and clip is checkpointed, `--resume` skips them after a crash or Ctrl-C
+        config = {"model": MODEL_NAME, "options": LLM_OPTIONS['best_b'], "prompt": PROMPT_TRAILER, "chunk_tokens": token_budget(MODEL_NAME), "smart_cut": USE_SMART_CUT}
+        manifest = RunManifest(arg_video_path, config, resume)
+
+        # Optional — diarize in another process while this one transcribes and queries, labels are added at the end
+        diarization = None
+        if diarize and not (USE_CACHED_TRANSCRIPTION and is_diarized(guest_name)):
+            diarization = start_diarization(arg_video_path)
+
+        # Step 1 — transcribe video, chunks are handed to the LLM as soon as their segments are transcribed
+        def transcribed():
+            yield from transcribe_stream(arg_video_path, guest_name, USE_CACHED_TRANSCRIPTION or manifest.stage_done("transcribe"))
+            manifest.complete_stage("transcribe")
+        chunks = enumerate(chunk_by_tokens(transcribed(), token_budget(MODEL_NAME)))
+
+        # Step 2 — Query the chunks
+        results_by_chunk: dict[int, PostQueryResults] = {}
+        def query(item):
+            i, chunk = item
+            results = manifest.chunk_results(i, chunk)
+            if results is None:
+                log(f"[+] Processing chuck: {i+1}")
+                results = query_clip_trailer_fulltext(chunk, MODEL_NAME, LLM_OPTIONS['best_b'], USE_CACHED_LLM_OUTPUT, 3)
+                manifest.complete_chunk(i, chunk, results)
+            else:
+                log(f"[skip] Chuck {i+1} was queried by the interrupted run")
+            results_by_chunk[i] = results
+            return [(i, chunk[0]['start'], results)]
+
+        # Step 3 — Post process output (middlewares), relevance is scored in full batches collected across chunks
+        # Step 4 — Output results, every surviving clip is cut as it arrives
+        # chunks finish in any order, clips are held back until every chunk they could overlap with was queried
+        dedup = StreamingDedup()
+        relevance = RelevanceBatcher()
+        clip_counter = count(manifest.next_clip_index())
+        def cut(clip):
+            if manifest.clip_done(clip):
+                return [clip]
+            i = next(clip_counter)
+            path = save_clip(clip, i, arg_video_path, clip_file_name, keyframes=keyframes)
+            if path:
+                # only clips ffmpeg finished are checkpointed, `--resume` cuts failed ones again
+                manifest.complete_clip(clip, path)
+                log(f"[+] Clip {i} ready after {format_duration(run.elapsed)}")
+            return [clip]
+
+        post_results = run_pipeline(chunks, [
+            # both LLM stages draw from the same `LLM_SLOTS`, at most LLM_MAX_PARALLEL requests are in flight between them
+            stage("query", query, workers=LLM_MAX_PARALLEL),
+            stage("dedup", lambda item: [dedup.add(*item)], flush=lambda: [dedup.flush()]),
+            stage("clean", lambda clips: [post_clean_obvious_clips(clips)]),
+            stage("filter", relevance.add, workers=LLM_MAX_PARALLEL, flush=relevance.flush),
+            stage("cut", cut, workers=2),
+        ])
+
+        all_results: PostQueryResults = [clip for i in sorted(results_by_chunk) for clip in results_by_chunk[i]]
+        save_cache('./all_results.json', all_results)
+        log(f"[+] llm_cache: {get_llm_cache().stats()}")
+        log(f"[+] LLM: {format_usage(tracer.totals(run))}")
+        log(f"[+] POST. {len(post_results)}/{len(all_results)} clips left")
+        output_text(post_results, slugify(MODEL_NAME, ''))
+        save_metadata(post_results)
+        if diarization is not None:
+            finish_diarization(diarization, guest_name)
+        manifest.complete_stage("finished", clips=len(post_results))
+        if resume:
+            log(f"[+] Resumed run: {manifest.summary()} ({len(results_by_chunk)} chunks, {len(post_results)} clips in total)")
+
+    tracer.export_chrome_trace(f"{DIR_OUTPUT}/trace_{clip_file_name}.json")
+    log(tracer.summary())
+    flush_logs()
+    print(f"[v] Finished cut! Duration: {format_duration(run.elapsed)}")
   
     
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cut highlight clips out of a podcast video")
+    parser.add_argument("--resume", action="store_true", help="continue the interrupted run of this video and config, skipping finished chunks and clips")
+    parser.add_argument("--diarize", action="store_true", default=use_diarization, help="also label the cached transcript with speakers")
+    args = parser.parse_args()
     print('[i] Start main')
-    main()
+    main(resume=args.resume, diarize=args.diarize)
@@ -0,0 +1,44 @@
+"""
+
+Registry of loaded WhisperX models.
+Models stay resident per (name, device, compute_type), so every transcription in the same process
+(streaming windows, batch runs over several episodes) skips the tens of seconds of model loading.
+
+"""
+import threading
+from collections import OrderedDict
+from utils import log, format_duration
+from tracing import tracer
+
+MAX_RESIDENT_MODELS = 3
+
+_models: OrderedDict = OrderedDict()
+_lock = threading.Lock()
+
+
+def _get_or_load(key: tuple, load):
+    """Least recently used cache around `load()`, the lock makes concurrent callers share one load."""
+    with _lock:
+        if key in _models:
+            _models.move_to_end(key)
+            return _models[key]
+        with tracer.span("load_model", key=key) as span:
+            model = load()
+        log(f"[+] models: Loaded {key} in {format_duration(span.elapsed)}")
+        _models[key] = model
+        while len(_models) > MAX_RESIDENT_MODELS:
+            evicted, _ = _models.popitem(last=False)
+            log(f"[i] models: Evicted {evicted}")
+        return model
+
+
+def load_asr_model(name="small.en", device="cpu", compute_type="int8"):
+    # whisperx pulls in torch, imported at first use so cached runs never pay for it
+    import whisperx
+    return _get_or_load(("asr", name, device, compute_type), lambda: whisperx.load_model(name, device=device, compute_type=compute_type))
+
+
+def load_align_model(language="en", device="cpu"):
+    """Returns (model, metadata) as `whisperx.load_align_model` does."""
+    import whisperx
+    return _get_or_load(("align", language, device), lambda: whisperx.load_align_model(language_code=language, device=device))
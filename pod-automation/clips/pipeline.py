@@ -0,0 +1,92 @@
+"""
+
+Streaming stage pipeline.
+Each stage runs in its own worker thread(s) and hands items to the next one through a bounded queue,
+so eg. transcription, LLM querying and ffmpeg cutting overlap instead of running as strict phases.
+Every item a stage handles is traced as a span named after the stage.
+
+"""
+import threading
+from queue import Queue
+from contextvars import copy_context
+from utils import log, log_context
+from utils import List, Callable, Iterable, Tuple, Optional
+from tracing import tracer
+
+_DONE = object()
+
+# (name, fn, workers, flush), `fn` takes one item and returns a list of items for the next stage (empty to drop it),
+# `flush` returns the items a stage still holds back once its input is exhausted (eg. a partly filled batch)
+Stage = Tuple[str, Callable[[any], list], int, Optional[Callable[[], list]]]
+
+
+def stage(name: str, fn: Callable[[any], list], workers=1, flush: Optional[Callable[[], list]] = None) -> Stage:
+    return (name, fn, max(1, workers), flush)
+
+
+def _feed(source: Iterable, outbox: Queue, errors: list):
+    try:
+        for item in source:
+            outbox.put(item)
+    except Exception as e:
+        log(f"[ERR] pipeline: source failed ({e})")
+        errors.append(e)
+    finally:
+        outbox.put(_DONE)
+
+
+def _handle(name: str, fn: Callable, args: tuple, outbox: Queue):
+    try:
+        with log_context(stage=name), tracer.span(name):
+            outs = list(fn(*args))
+        for out in outs:
+            outbox.put(out)
+    except Exception as e:
+        log(f"[ERR] pipeline: stage '{name}' failed on an item ({e})")
+
+
+def _work(name: str, fn: Callable, flush: Optional[Callable], inbox: Queue, outbox: Queue, remaining: list, lock: threading.Lock):
+    while True:
+        item = inbox.get()
+        if item is _DONE:
+            # hand the sentinel to sibling workers, the last one out flushes and closes the next stage
+            inbox.put(_DONE)
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                if flush is not None:
+                    _handle(name, flush, (), outbox)
+                outbox.put(_DONE)
+            return
+        _handle(name, fn, (item,), outbox)
+
+
+def run_pipeline(source: Iterable, stages: List[Stage], maxsize=32) -> list:
+    """
+    Push every item of `source` through `stages` and return what comes out of the last one.
+    Items leave a stage as soon as they are processed; with multiple workers order is not preserved.
+    Workers run in a copy of the caller's context, so log fields and the current span carry over.
+    A failing item is logged and dropped, but a failing source is re-raised once the items it gave are through.
+    """
+    queues = [Queue(maxsize) for _ in stages] + [Queue()]
+    source_errors = []
+    threads = [threading.Thread(target=copy_context().run, args=(_feed, source, queues[0], source_errors), name="pipeline-source", daemon=True)]
+    for i, (name, fn, workers, flush) in enumerate(stages):
+        remaining, lock = [workers], threading.Lock()
+        for n in range(workers):
+            threads.append(threading.Thread(
+                target=copy_context().run, args=(_work, name, fn, flush, queues[i], queues[i + 1], remaining, lock),
+                name=f"pipeline-{name}-{n}", daemon=True,
+            ))
+    for t in threads:
+        t.start()
+
+    results = []
+    while (item := queues[-1].get()) is not _DONE:
+        results.append(item)
+    for t in threads:
+        t.join()
+    if source_errors:
+        raise source_errors[0]
+    return results
@@ -0,0 +1,117 @@
+"""
+
+Resumable run manifest.
+One JSON file per (video content, pipeline config) in `cache/runs/`, every finished unit of work (a stage, a queried
+chunk, a cut clip) is written to it right away and atomically, so an interrupted run can pick up where it stopped:
+    python main.py --resume
+
+"""
+import os, json, hashlib, threading, tempfile
+from utils import log, timestamp_date, content_hash
+from utils import DIR_CACHE, PostQueryResults, List, Word, Optional
+
+DIR_RUNS = f"{DIR_CACHE}/runs"
+
+
+def config_hash(config: dict) -> str:
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def chunk_span(chunk: List[dict]) -> List[float]:
+    """Identifies a chunk, a resumed run only reuses results of a chunk that covers the same time range."""
+    return [chunk[0]['start'], chunk[-1]['end']] if chunk else []
+
+
+def clip_key(clip: List[Word]) -> str:
+    return f"{clip[0]['start']:.3f}-{clip[-1]['end']:.3f}"
+
+
+class RunManifest:
+    def __init__(self, video_path: str, config: dict, resume=False, runs_dir: str = DIR_RUNS):
+        os.makedirs(runs_dir, exist_ok=True)
+        self.video_hash = content_hash(video_path)
+        self.config_hash = config_hash(config)
+        self.path = f"{runs_dir}/{self.video_hash}-{self.config_hash}.json"
+        self.skipped = {"stages": 0, "chunks": 0, "clips": 0}
+        self._lock = threading.Lock()
+
+        state = None
+        if resume and os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            log(f"[+] run_manifest: Resuming run from {state['updated']} ({len(state['chunks'])} chunks, {len(state['clips'])} clips done)")
+        elif resume:
+            log(f"[i] run_manifest: Nothing to resume for this video and config, starting fresh")
+        self.state = state or {
+            "video": video_path,
+            "video_hash": self.video_hash,
+            "config_hash": self.config_hash,
+            "config": config,
+            "created": timestamp_date(),
+            "updated": timestamp_date(),
+            "stages": {},
+            "chunks": {},
+            "clips": {},
+        }
+        self._save()
+
+    def _save(self) -> None:
+        """Write to a temporary file next to the manifest and rename it over, a crash never leaves half a manifest."""
+        self.state["updated"] = timestamp_date()
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=".manifest-", suffix=".json")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    # ---- stages ---- #
+    def stage_done(self, name: str) -> bool:
+        with self._lock:
+            done = name in self.state["stages"]
+            self.skipped["stages"] += done
+        return done
+
+    def complete_stage(self, name: str, **info) -> None:
+        with self._lock:
+            self.state["stages"][name] = {"finished": timestamp_date(), **info}
+            self._save()
+
+    # ---- chunks ---- #
+    def chunk_results(self, i: int, chunk: List[dict]) -> Optional[PostQueryResults]:
+        """Results of chunk `i` from an earlier run, None if it still has to be queried."""
+        with self._lock:
+            entry = self.state["chunks"].get(str(i))
+            if entry is None or entry["span"] != chunk_span(chunk):
+                return None
+            self.skipped["chunks"] += 1
+            return entry["results"]
+
+    def complete_chunk(self, i: int, chunk: List[dict], results: PostQueryResults) -> None:
+        with self._lock:
+            self.state["chunks"][str(i)] = {"span": chunk_span(chunk), "results": results}
+            self._save()
+
+    # ---- clips ---- #
+    def clip_done(self, clip: List[Word]) -> bool:
+        with self._lock:
+            path = self.state["clips"].get(clip_key(clip))
+            done = path is not None and os.path.exists(path)
+            self.skipped["clips"] += done
+        return done
+
+    def next_clip_index(self) -> int:
+        """Clip numbers continue after the clips of the earlier run, so new files never overwrite them."""
+        return len(self.state["clips"])
+
+    def complete_clip(self, clip: List[Word], path: str) -> None:
+        with self._lock:
+            self.state["clips"][clip_key(clip)] = path
+            self._save()
+
+    def summary(self) -> str:
+        return ", ".join(f"{count} {unit}" for unit, count in self.skipped.items()) + " skipped"
@@ -0,0 +1,6 @@
+import sys, os
+from pathlib import Path
+
+# the clips modules import each other as top level modules (`from utils import ...`)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("CLIPS_LOG_LEVEL", "error")
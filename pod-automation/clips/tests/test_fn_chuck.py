@@ -0,0 +1,80 @@
+import random
+import pytest
+from fn_chuck import chunk_by_tokens, estimate_tokens, context_options, token_budget
+
+
+def make_segments(count, seconds=10.0, words=20):
+    return [{"start": i * seconds, "end": (i + 1) * seconds, "text": " ".join(["word"] * words), "words": []} for i in range(count)]
+
+
+def test_chunks_fit_the_budget():
+    segments = make_segments(200)
+    max_tokens = 10 * estimate_tokens(segments[0]['text'])
+    chunks = list(chunk_by_tokens(segments, max_tokens, overlap_seconds=30))
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert sum(estimate_tokens(seg['text']) for seg in chunk) <= max_tokens
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_mixed_segments_fit_the_budget(seed):
+    rng = random.Random(seed)
+    segments = [
+        {"start": i * 10.0, "end": (i + 1) * 10.0, "text": " ".join(["word"] * rng.choice([2, 10, 40, 70])), "words": []}
+        for i in range(300)
+    ]
+    max_tokens = 100
+    for overlap in (0, 30, 120):
+        chunks = list(chunk_by_tokens(segments, max_tokens, overlap_seconds=overlap))
+        for chunk in chunks:
+            assert sum(estimate_tokens(seg['text']) for seg in chunk) <= max_tokens
+        assert [seg for seg in segments if not any(seg in chunk for chunk in chunks)] == []
+
+
+def test_chunks_overlap_by_the_previous_chunks_tail():
+    segments = make_segments(200)
+    chunks = list(chunk_by_tokens(segments, 10 * estimate_tokens(segments[0]['text']), overlap_seconds=30))
+    for previous, chunk in zip(chunks, chunks[1:]):
+        shared = [seg for seg in chunk if seg in previous]
+        assert shared, "consecutive chunks share no segments"
+        # the shared segments are the tail of the previous chunk and the head of the next one
+        assert shared == previous[-len(shared):] == chunk[:len(shared)]
+        assert previous[-1]['end'] - shared[0]['start'] >= 30
+
+
+def test_every_segment_is_covered_in_order():
+    segments = make_segments(123)
+    chunks = list(chunk_by_tokens(segments, 7 * estimate_tokens(segments[0]['text']), overlap_seconds=20))
+    seen = []
+    for chunk in chunks:
+        seen += [seg for seg in chunk if not seen or seg['start'] > seen[-1]['start']]
+    assert seen == segments
+
+
+def test_overlap_only_window_is_never_emitted():
+    # every chunk has to bring at least one segment the previous chunks didn't have, including the last one
+    segments = make_segments(50)
+    for overlap in (0, 10, 30, 1000):
+        chunks = list(chunk_by_tokens(segments, 5 * estimate_tokens(segments[0]['text']), overlap_seconds=overlap))
+        emitted = set()
+        for chunk in chunks:
+            new = {seg['start'] for seg in chunk} - emitted
+            assert new, f"chunk of only already emitted segments (overlap={overlap})"
+            emitted |= new
+        assert len(chunks) == len({tuple(seg['start'] for seg in chunk) for chunk in chunks})
+
+
+def test_oversized_segment_gets_its_own_chunk():
+    segments = make_segments(10)
+    segments[4]['text'] = "word " * 1000
+    chunks = list(chunk_by_tokens(segments, 5 * estimate_tokens(segments[0]['text'])))
+    assert any(segments[4] in chunk for chunk in chunks)
+    assert sum(segments[4] in chunk for chunk in chunks) <= 2
+
+
+def test_context_options_match_the_budget():
+    options = context_options("llama3", {"temperature": 0.2})
+    assert options == {"num_ctx": 8192, "temperature": 0.2}
+    assert token_budget("llama3") < options["num_ctx"]
+    # an explicit num_ctx wins
+    assert context_options("llama3", {"num_ctx": 4096})["num_ctx"] == 4096
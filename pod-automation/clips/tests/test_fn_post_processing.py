@@ -0,0 +1,102 @@
+import random
+import pytest
+from fn_post_processing import post_dedup_overlapping_clips, post_clean_obvious_clips, StreamingDedup, RelevanceBatcher, IntervalIndex
+
+
+def make_clip(start, end, score=0.5, words=4):
+    step = (end - start) / words
+    return [{"word": "w", "start": start + k * step, "end": start + (k + 1) * step, "score": score} for k in range(words)]
+
+
+def test_overlap_is_measured_against_the_shorter_clip():
+    long, short = make_clip(0, 50, score=0.9), make_clip(40, 60, score=0.1)
+    # 10s of the 20s short clip are shared: exactly the threshold
+    assert post_dedup_overlapping_clips([long, short], overlap_threshold=0.5) == [long]
+    assert post_dedup_overlapping_clips([long, short], overlap_threshold=0.6) == [long, short]
+
+
+def test_best_scoring_clip_wins_and_order_is_kept():
+    first, best, last = make_clip(0, 10, score=0.2), make_clip(5, 15, score=0.9), make_clip(30, 40, score=0.1)
+    assert post_dedup_overlapping_clips([first, best, last]) == [best, last]
+
+
+def test_touching_and_empty_clips():
+    a, b = make_clip(0, 10), make_clip(10, 20)
+    # empty clips are left to `post_clean_obvious_clips`
+    assert post_dedup_overlapping_clips([a, [], b], overlap_threshold=0) == [a, [], b]
+
+
+def test_clips_clean_drops_dont_suppress_valid_ones():
+    too_long, valid = make_clip(0, 100, score=0.9), make_clip(10, 40, score=0.8)
+    assert post_clean_obvious_clips(post_dedup_overlapping_clips([too_long, valid])) == [valid]
+
+
+def make_chunks(rng, count=12, seconds=120, overlap=30):
+    chunks = []
+    for i in range(count):
+        start = i * (seconds - overlap)
+        clips = []
+        for _ in range(rng.randint(0, 4)):
+            s = rng.uniform(start, start + seconds - 5)
+            clips.append(make_clip(s, min(start + seconds, s + rng.choice([3, 10, 30, 70])), score=rng.random()))
+        chunks.append((i, float(start), clips))
+    return chunks
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_streaming_dedup_matches_one_pass_in_any_arrival_order(seed):
+    rng = random.Random(seed)
+    chunks = make_chunks(rng)
+    expected = post_dedup_overlapping_clips([clip for _, _, clips in chunks for clip in clips])
+    rng.shuffle(chunks)
+    dedup = StreamingDedup()
+    streamed = [clip for chunk in chunks for clip in dedup.add(*chunk)] + dedup.flush()
+    key = lambda clip: (clip[0]['start'], clip[-1]['end'])
+    assert sorted(streamed, key=key) == sorted(expected, key=key)
+
+
+def test_later_chunk_with_a_better_clip_wins():
+    dedup = StreamingDedup()
+    assert dedup.add(1, 90, [make_clip(95, 110, score=0.2)]) == []
+    assert dedup.add(2, 180, [make_clip(185, 200)]) == []
+    # chunk 0 arrives last, its better clip replaces the held back one
+    assert dedup.add(0, 0, [make_clip(96, 112, score=0.9), make_clip(10, 30)]) == [make_clip(10, 30), make_clip(96, 112, score=0.9)]
+    assert dedup.flush() == [make_clip(185, 200)]
+
+
+@pytest.mark.parametrize("threshold", [0, 0.2, 0.5, 1.0])
+def test_index_matches_a_linear_scan(threshold):
+    rng = random.Random(threshold)
+    index, kept = IntervalIndex(threshold), []
+    for _ in range(2000):
+        start = rng.uniform(0, 5000)
+        end = start + rng.choice([0, rng.uniform(0, 5), rng.uniform(0, 200)])
+        expected = any(index._overlapping(start, end, *k) for k in kept)
+        assert index.overlaps(start, end) == expected
+        if not expected:
+            index.add(start, end)
+            kept.append((start, end))
+
+
+def test_relevance_is_scored_in_full_batches_across_calls(tmp_path, monkeypatch):
+    import json, llm_cache, llm_transport
+    requests = []
+    def respond(prompt):
+        requests.append(prompt)
+        return json.dumps({str(k): "YES" for k in range(1, prompt.count("\n") + 2)})
+    monkeypatch.setattr(llm_transport, "_transport", llm_transport.ReplayTransport(responder=respond))
+    monkeypatch.setattr(llm_cache, "_llm_cache", llm_cache.LLMCache(str(tmp_path / "llm_cache.sqlite")))
+
+    relevance = RelevanceBatcher(batch_size=10)
+    kept = []
+    for chunk in range(7):
+        clips = [make_clip(chunk * 100 + k * 10, chunk * 100 + k * 10 + 8) for k in range(3)]
+        for k, clip in enumerate(clips):
+            clip[0]["word"] = f"clip{chunk}-{k}"
+        kept += relevance.add(clips)
+    kept += relevance.flush()
+    assert len(kept) == 21
+    # 10 + 10 + 1 clips, instead of one request per chunk
+    assert len(requests) == 3
+    # decided clips don't wait for a batch
+    assert relevance.add([kept[0]]) == [kept[0]] and len(requests) == 3
@@ -0,0 +1,57 @@
+import json
+from functools import partial
+import pytest
+import fn_query, llm_cache, llm_transport
+from fn_query import query_with_retries, _repair_messages, _chunk_messages, PROMPT_TRAILER
+
+TEXT = "so the thing about running a podcast is that you never know who shows up next and that is the fun part of it"
+HIGHLIGHT = "you never know who shows up next and that is the fun part"
+
+
+def make_chunk():
+    words = [{"word": w, "start": i, "end": i + 1, "score": 0.9} for i, w in enumerate(TEXT.split())]
+    return [{"start": 0, "end": len(words), "text": TEXT, "words": words}]
+
+
+@pytest.fixture
+def answers(tmp_path, monkeypatch):
+    """Scripted model: returns the answers in order and records the last message of every request."""
+    script, prompts = [], []
+    def respond(prompt):
+        prompts.append(prompt)
+        return script.pop(0)
+    monkeypatch.setattr(llm_transport, "_transport", llm_transport.ReplayTransport(responder=respond))
+    monkeypatch.setattr(llm_cache, "_llm_cache", llm_cache.LLMCache(str(tmp_path / "llm_cache.sqlite")))
+    return script, prompts
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_broken_answer_is_repaired_instead_of_asked_again(answers, monkeypatch, stream):
+    monkeypatch.setattr(fn_query, "_ask_highlights", partial(fn_query._ask_highlights, stream=stream))
+    repaired = []
+    monkeypatch.setattr(fn_query, "_repair_messages", lambda content: repaired.append(content) or _repair_messages(content))
+    script, prompts = answers
+    broken = f'["{HIGHLIGHT}", trailing prose instead of a string'
+    script += [broken, json.dumps([HIGHLIGHT])]
+    chunk = make_chunk()
+
+    results = query_with_retries(chunk, "llama3", _chunk_messages(PROMPT_TRAILER, chunk), {}, retry_count=1)
+
+    assert len(prompts) == 2
+    # the follow-up is the short repair prompt with the broken array in it, not the chunk again
+    # a stream stops being read at the bad character, the repair gets what was read up to there
+    assert len(repaired) == 1 and broken.startswith(repaired[0]) and f'["{HIGHLIGHT}", t' in repaired[0]
+    assert prompts[1] == _repair_messages(repaired[0])[-1]["content"]
+    assert [" ".join(w["word"] for w in clip) for clip in results] == [HIGHLIGHT]
+
+
+def test_answer_without_an_array_is_asked_again_in_full(answers):
+    script, prompts = answers
+    script += ["Sure! Here are the highlights you asked for, " * 10, json.dumps([HIGHLIGHT])]
+    chunk = make_chunk()
+    messages = _chunk_messages(PROMPT_TRAILER, chunk)
+
+    results = query_with_retries(chunk, "llama3", messages, {}, retry_count=1)
+
+    assert prompts == [messages[-1]["content"]] * 2
+    assert len(results) == 1
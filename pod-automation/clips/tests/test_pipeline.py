@@ -0,0 +1,27 @@
+import pytest
+from pipeline import run_pipeline, stage
+
+
+def test_items_go_through_every_stage():
+    results = run_pipeline(range(20), [stage("double", lambda x: [x * 2], workers=3), stage("odd", lambda x: [x + 1] if x % 4 else [])])
+    assert sorted(results) == [x * 2 + 1 for x in range(20) if x % 2]
+
+
+def test_flush_runs_once_after_the_last_item():
+    held = []
+    results = run_pipeline(range(5), [stage("hold", lambda x: held.append(x) or [], workers=2, flush=lambda: [sorted(held)])])
+    assert results == [[0, 1, 2, 3, 4]]
+
+
+def test_failing_source_is_raised_after_its_items_are_through():
+    def source():
+        yield from range(3)
+        raise RuntimeError("decode failed")
+    seen = []
+    with pytest.raises(RuntimeError, match="decode failed"):
+        run_pipeline(source(), [stage("see", lambda x: seen.append(x) or [x])])
+    assert seen == [0, 1, 2]
+
+
+def test_failing_item_is_dropped():
+    assert sorted(run_pipeline(range(4), [stage("div", lambda x: [12 // x])])) == [4, 6, 12]
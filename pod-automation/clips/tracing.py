@@ -0,0 +1,160 @@
+"""
+
+Structured span tracer.
+Spans nest per thread / async task (the current span lives in a ContextVar), counters are attributed to the
+innermost open span. A run can be exported as Chrome trace JSON (chrome://tracing, ui.perfetto.dev) and summarized
+as a per-stage table.
+
+Usage:
+    with tracer.span("llm", model=model_name) as span:
+        ...
+        tracer.count("tokens_in", 1200)
+    log(f"Took {format_duration(span.elapsed)}")
+
+"""
+import os, json, threading
+from itertools import count
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import defaultdict
+from time import perf_counter, time
+from utils import format_duration
+from utils import Optional, Iterator, List
+
+
+class Span:
+    _ids = count(1)
+
+    def __init__(self, name: str, parent: Optional["Span"], attrs: dict):
+        self.id = next(Span._ids)
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.counters: dict[str, float] = defaultdict(float)
+        self.thread = threading.current_thread().name
+        self.thread_id = threading.get_ident()
+        self.start = perf_counter()
+        self.end: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end or perf_counter()) - self.start
+
+    @property
+    def depth(self) -> int:
+        return 0 if self.parent is None else self.parent.depth + 1
+
+
+class Tracer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+        self._origin = (perf_counter(), time())
+        self.spans: List[Span] = []
+        self.counters: dict[str, float] = defaultdict(float)
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[Span]:
+        span = Span(name, self._current.get(), attrs)
+        token = self._current.set(span)
+        try:
+            yield span
+        finally:
+            span.end = perf_counter()
+            self._current.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+    def count(self, name: str, value: float = 1) -> None:
+        """Add to a run wide counter and to the counters of the current span."""
+        span = self._current.get()
+        with self._lock:
+            self.counters[name] += value
+            if span is not None:
+                span.counters[name] += value
+
+    def totals(self, root: Span) -> dict[str, float]:
+        """Counters summed over `root` and every finished span nested in it, eg. all LLM usage of an episode."""
+        with self._lock:
+            spans = list(self.spans)
+        totals = defaultdict(float, root.counters)
+        for span in spans:
+            parent = span.parent
+            while parent is not None and parent is not root:
+                parent = parent.parent
+            if parent is root:
+                for name, value in span.counters.items():
+                    totals[name] += value
+        return dict(totals)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.spans = []
+            self.counters = defaultdict(float)
+
+    def export_chrome_trace(self, path: str) -> None:
+        """Complete ('X') events in microseconds, one track per thread."""
+        origin_perf, origin_wall = self._origin
+        with self._lock:
+            spans = list(self.spans)
+        events = [{
+            "name": span.name,
+            "cat": "clips",
+            "ph": "X",
+            "ts": (origin_wall + span.start - origin_perf) * 1e6,
+            "dur": span.elapsed * 1e6,
+            "pid": os.getpid(),
+            "tid": span.thread_id,
+            "args": {**{k: str(v) for k, v in span.attrs.items()}, **span.counters},
+        } for span in spans]
+        threads = {span.thread_id: span.thread for span in spans}
+        events += [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}} for tid, name in threads.items()]
+        with open(path, 'w') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f"[i] Saved trace to '{path}'")
+
+    def summary(self) -> str:
+        """Per span name: calls, total/mean/max time and summed counters, slowest first."""
+        with self._lock:
+            spans = list(self.spans)
+        stages = defaultdict(lambda: {"calls": 0, "total": 0.0, "max": 0.0, "counters": defaultdict(float)})
+        for span in spans:
+            stage = stages[span.name]
+            stage["calls"] += 1
+            stage["total"] += span.elapsed
+            stage["max"] = max(stage["max"], span.elapsed)
+            for name, value in span.counters.items():
+                stage["counters"][name] += value
+
+        rows = [f"{'stage':<18}{'calls':>7}{'total':>11}{'mean':>11}{'max':>11}  counters"]
+        for name, stage in sorted(stages.items(), key=lambda item: -item[1]["total"]):
+            counters = ", ".join(f"{k}={v:g}" for k, v in stage["counters"].items())
+            rows.append(
+                f"{name:<18}{stage['calls']:>7}{format_duration(stage['total']):>11}"
+                f"{format_duration(stage['total'] / stage['calls']):>11}{format_duration(stage['max']):>11}  {counters}"
+            )
+        rows.append("totals: " + ", ".join(f"{k}={v:g}" for k, v in self.counters.items()))
+        return "\n".join(rows)
+
+
+tracer = Tracer()
+
+
+def count_usage(resp) -> None:
+    """Token counts and ollama's timings of a `ChatResponse` on the current span: prefill (prompt eval), generation (eval) and model loads."""
+    tracer.count("tokens_in", resp.prompt_eval_count)
+    tracer.count("tokens_out", resp.eval_count)
+    tracer.count("prompt_eval_sec", resp.prompt_eval_duration / 1e9)
+    tracer.count("eval_sec", resp.eval_duration / 1e9)
+    tracer.count("load_sec", resp.load_duration / 1e9)
+
+
+def format_usage(counters: dict) -> str:
+    """One line LLM report from summed `count_usage` counters, eg. for an episode."""
+    def rate(tokens, seconds):
+        return f"{tokens / seconds:.0f} tok/s" if seconds else "n/a"
+    return (
+        f"prefill {format_duration(counters.get('prompt_eval_sec', 0))} for {counters.get('tokens_in', 0):g} tokens ({rate(counters.get('tokens_in', 0), counters.get('prompt_eval_sec', 0))}), "
+        f"generation {format_duration(counters.get('eval_sec', 0))} for {counters.get('tokens_out', 0):g} tokens ({rate(counters.get('tokens_out', 0), counters.get('eval_sec', 0))}), "
+        f"model loads {format_duration(counters.get('load_sec', 0))}"
+    )
@@ -0,0 +1,207 @@
+"""
+
+Columnar transcript storage.
+Words are kept as NumPy columns (start/end/score, interned token ids) with segment offsets, and persisted as a
+directory of `.npy` files that are memory-mapped on load. Nothing is parsed or allocated per word until it is read.
+`transcript['segments']` / `transcript['word_segments']` return lazy views that build the usual `Segment`/`Word`
+dicts on access, so dict-based code keeps working unchanged.
+
+"""
+import os, json, shutil
+import numpy as np
+from collections.abc import Sequence
+from utils import Transcript, Segment, Word, List, Optional
+
+_COLUMNS = ("word_ids", "word_start", "word_end", "word_score", "seg_start", "seg_end", "seg_offsets", "text_bytes", "text_offsets")
+# speaker label ids per word / segment (-1 unlabeled), only present once the transcript was diarized
+_SPEAKER_COLUMNS = ("word_speaker", "seg_speaker")
+
+
+class ColumnarTranscript:
+    def __init__(self, columns: dict, vocab: List[str], speakers: Optional[List[str]] = None):
+        self.vocab = vocab
+        self.speakers = speakers
+        self.word_speaker: Optional[np.ndarray] = columns.get("word_speaker")
+        self.seg_speaker: Optional[np.ndarray] = columns.get("seg_speaker")
+        self.word_ids: np.ndarray = columns["word_ids"]
+        self.word_start: np.ndarray = columns["word_start"]
+        self.word_end: np.ndarray = columns["word_end"]
+        self.word_score: np.ndarray = columns["word_score"]
+        self.seg_start: np.ndarray = columns["seg_start"]
+        self.seg_end: np.ndarray = columns["seg_end"]
+        self.seg_offsets: np.ndarray = columns["seg_offsets"]
+        self.text_bytes: np.ndarray = columns["text_bytes"]
+        self.text_offsets: np.ndarray = columns["text_offsets"]
+
+    @classmethod
+    def from_transcript(cls, transcript: Transcript) -> "ColumnarTranscript":
+        """
+        Keeps what `Segment`/`Word` define, including the optional "speaker" labels. Any other key whisperx or a
+        caller adds (eg. per word "probability") is not stored and is dropped.
+        """
+        vocab_ids: dict[str, int] = {}
+        speaker_ids: dict[str, int] = {}
+        word_ids, word_start, word_end, word_score, word_speaker = [], [], [], [], []
+        seg_start, seg_end, seg_offsets, text_offsets, seg_speaker = [], [], [0], [0], []
+        texts = bytearray()
+        for seg in transcript["segments"]:
+            for word in seg["words"]:
+                word_ids.append(vocab_ids.setdefault(word["word"], len(vocab_ids)))
+                # whisperx leaves some tokens (eg. numbers) without timing or score
+                word_start.append(word.get("start", np.nan))
+                word_end.append(word.get("end", np.nan))
+                word_score.append(word.get("score", np.nan))
+                word_speaker.append(speaker_ids.setdefault(word["speaker"], len(speaker_ids)) if "speaker" in word else -1)
+            seg_start.append(seg["start"])
+            seg_end.append(seg["end"])
+            seg_offsets.append(len(word_ids))
+            seg_speaker.append(speaker_ids.setdefault(seg["speaker"], len(speaker_ids)) if "speaker" in seg else -1)
+            texts += seg["text"].encode("utf-8")
+            text_offsets.append(len(texts))
+        columns = {
+            "word_ids": np.array(word_ids, dtype=np.int32),
+            "word_start": np.array(word_start, dtype=np.float64),
+            "word_end": np.array(word_end, dtype=np.float64),
+            "word_score": np.array(word_score, dtype=np.float64),
+            "seg_start": np.array(seg_start, dtype=np.float64),
+            "seg_end": np.array(seg_end, dtype=np.float64),
+            "seg_offsets": np.array(seg_offsets, dtype=np.int64),
+            "text_bytes": np.frombuffer(bytes(texts), dtype=np.uint8),
+            "text_offsets": np.array(text_offsets, dtype=np.int64),
+        }
+        columnar = cls(columns, list(vocab_ids))
+        if speaker_ids:
+            columnar.set_speakers(list(speaker_ids), word_speaker, seg_speaker)
+        return columnar
+
+    def set_speakers(self, speakers: List[str], word_speaker: np.ndarray, seg_speaker: np.ndarray) -> None:
+        """Label words and segments with indices into `speakers` (-1 for none), as `save` then persists."""
+        self.speakers = speakers
+        self.word_speaker = np.asarray(word_speaker, dtype=np.int16)
+        self.seg_speaker = np.asarray(seg_speaker, dtype=np.int16)
+
+    # ------- persistence ------- #
+
+    def save(self, path: str) -> None:
+        """Write the bundle directory atomically (a reader never sees a half written transcript)."""
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in _COLUMNS:
+            np.save(f"{tmp_path}/{name}.npy", getattr(self, name))
+        with open(f"{tmp_path}/vocab.json", 'w') as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        if self.speakers is not None:
+            for name in _SPEAKER_COLUMNS:
+                np.save(f"{tmp_path}/{name}.npy", getattr(self, name))
+            with open(f"{tmp_path}/speakers.json", 'w') as f:
+                json.dump(self.speakers, f, ensure_ascii=False)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        print(f"[i] Saved columnar transcript to '{path}'")
+
+    @classmethod
+    def load(cls, path: str) -> "ColumnarTranscript":
+        columns = {name: np.load(f"{path}/{name}.npy", mmap_mode='r') for name in _COLUMNS}
+        with open(f"{path}/vocab.json") as f:
+            vocab = json.load(f)
+        speakers = None
+        if os.path.exists(f"{path}/speakers.json"):
+            columns.update({name: np.load(f"{path}/{name}.npy", mmap_mode='r') for name in _SPEAKER_COLUMNS})
+            with open(f"{path}/speakers.json") as f:
+                speakers = json.load(f)
+        print(f"[i] Loaded columnar transcript from '{path}'")
+        return cls(columns, vocab, speakers)
+
+    # ------- dict compatible views ------- #
+
+    def __len__(self) -> int:
+        return len(self.seg_start)
+
+    def __getitem__(self, key: str):
+        if key == "segments":
+            return SegmentsView(self)
+        if key == "word_segments":
+            return WordsView(self)
+        raise KeyError(key)
+
+    def text(self, i: int) -> str:
+        return bytes(self.text_bytes[self.text_offsets[i]:self.text_offsets[i + 1]]).decode("utf-8")
+
+    def words(self, lo: int, hi: int) -> List[Word]:
+        words: List[Word] = []
+        vocab = self.vocab
+        columns = zip(self.word_ids[lo:hi].tolist(), self.word_start[lo:hi].tolist(), self.word_end[lo:hi].tolist(), self.word_score[lo:hi].tolist())
+        for token, start, end, score in columns:
+            word = {"word": vocab[token]}
+            if start == start:  # NaN check: keep the key absent like whisperx does
+                word["start"] = start
+            if end == end:
+                word["end"] = end
+            if score == score:
+                word["score"] = score
+            words.append(word)
+        if self.speakers is not None:
+            # like `whisperx.assign_word_speakers`, unlabeled words have no "speaker" key
+            for word, speaker in zip(words, self.word_speaker[lo:hi].tolist()):
+                if speaker >= 0:
+                    word["speaker"] = self.speakers[speaker]
+        return words
+
+    def segment(self, i: int) -> Segment:
+        segment = {
+            "start": float(self.seg_start[i]),
+            "end": float(self.seg_end[i]),
+            "text": self.text(i),
+            "words": self.words(int(self.seg_offsets[i]), int(self.seg_offsets[i + 1])),
+        }
+        if self.speakers is not None and self.seg_speaker[i] >= 0:
+            segment["speaker"] = self.speakers[self.seg_speaker[i]]
+        return segment
+
+    def to_transcript(self) -> Transcript:
+        segments = [self.segment(i) for i in range(len(self))]
+        return {"segments": segments, "word_segments": [w for seg in segments for w in seg["words"]]}
+
+
+class SegmentsView(Sequence):
+    """Read-only list of `Segment` dicts, each built when accessed."""
+    def __init__(self, transcript: ColumnarTranscript):
+        self._transcript = transcript
+
+    def __len__(self) -> int:
+        return len(self._transcript)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._transcript.segment(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._transcript.segment(i)
+
+
+class WordsView(Sequence):
+    """Read-only list of all `Word` dicts, each built when accessed."""
+    def __init__(self, transcript: ColumnarTranscript):
+        self._transcript = transcript
+
+    def __len__(self) -> int:
+        return len(self._transcript.word_ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            return self._transcript.words(start, stop)[::step]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._transcript.words(i, i + 1)[0]
+
+    def __iter__(self):
+        # segment sized batches instead of one numpy access per word
+        offsets = self._transcript.seg_offsets
+        for i in range(len(offsets) - 1):
+            yield from self._transcript.words(int(offsets[i]), int(offsets[i + 1]))
@@ -1,5 +1,5 @@
 from pathlib import Path
-import os, json, re
+import os, json, re, threading
 # ------------------------------- #
 # ----------- consts ------------ #
 # ------------------------------- #
@@ -10,6 +10,42 @@ DIR_OUTPUT = f"{DIR_PROJECT}/output"
 
 FILE_METADATA=f"{DIR_OUTPUT}/metadata.json"
 
+# context window (tokens) per model, ollama uses 2048 for anything not set explicitly
+DEFAULT_CONTEXT = 2048
+MODEL_CONTEXT = {
+    "llama3": 8192,
+    "qwen2.5:7b-instruct-q4_K_M": 32768,
+    "yi:9b-chat-v1.5-q6_K": 4096,
+    "spooknik/hermes-2-pro-mistral-7b:q8": 8192,
+    "qwen3:4b-thinking-2507-fp16": 32768,
+}
+
+# max LLM requests in flight, keep in sync with the server's `OLLAMA_NUM_PARALLEL`
+LLM_MAX_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", 4))
+# held for every request, so all stages (querying, relevance filtering, batch episodes) share that bound
+LLM_SLOTS = threading.BoundedSemaphore(LLM_MAX_PARALLEL)
+# how long ollama keeps a model loaded after a request, so chunks and episodes don't pay for reloads
+LLM_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+# stream highlight answers, map each highlight as it arrives and abort answers that aren't a JSON array
+LLM_STREAM = os.environ.get("CLIPS_LLM_STREAM", "1") != "0"
+
+# -------- pipeline settings (main.py and batch.py) -------- #
+
+MODEL_NAME = "llama3" # no-long-context, mehmeh-quality
+# MODEL_NAME = "qwen2.5:7b-instruct-q4_K_M" # meh-quality-clips
+MODEL_NAME = "yi:9b-chat-v1.5-q6_K" # +long context, meh_ok-quality, 
+# MODEL_NAME = "spooknik/hermes-2-pro-mistral-7b:q8" # ..
+# MODEL_NAME = "qwen3:4b-thinking-2507-fp16" # insanely slo, but has thinking output which we don't want
+
+# TRY: MythoMax-L2
+# TRY?: OpenChat 3.6
+
+# -uncensored
+
+USE_CACHED_TRANSCRIPTION=True # won't redo transcribe
+USE_CACHED_LLM_OUTPUT=False # won't redo prompts (only useful if you are testing postprocessing)
+USE_SMART_CUT=True # frame accurate clips, re-encodes only the partial GOPs at the clip edges
+
 os.makedirs(DIR_CACHE, exist_ok=True)
 os.makedirs(DIR_OUTPUT, exist_ok=True)
 
@@ -17,7 +53,7 @@ os.makedirs(DIR_OUTPUT, exist_ok=True)
 # ------------------------------- #
 # ------------ Utils ------------ #
 # ------------------------------- #
-from time import time, gmtime, strftime
+from time import gmtime, strftime
 from datetime import datetime
 import subprocess
 
@@ -34,12 +70,98 @@ def save_cache(file_path: str, content: any, append=False) -> None:
     print(f"[i] Saved cache to '{file_path}'")
 
 
-def log(content: any, newlines=1) -> None:
-    print(content)
-    with open(f"{DIR_PROJECT}/logs.txt", 'a') as f:
-        f.write('\n' * newlines)
-        f.write(f"{timestamp_time()}  {str(content)}")
-        # json.dump(content, f, indent=2)
+# ------------------------------- #
+# ----------- Logging ----------- #
+# ------------------------------- #
+# `log` only enqueues, a background thread prints and appends batches to logs.txt (human) and logs.jsonl (records)
+import threading, atexit, secrets
+from time import time
+from queue import Queue, Empty
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+FILE_LOG = f"{DIR_PROJECT}/logs.txt"
+FILE_LOG_JSONL = f"{DIR_PROJECT}/logs.jsonl"
+LOG_LEVELS = {"debug": 10, "info": 20, "warn": 30, "error": 40}
+# minimum level printed to the console, files always get everything
+LOG_LEVEL = os.environ.get("CLIPS_LOG_LEVEL", "info")
+RUN_ID = f"{strftime('%Y%m%d-%H%M%S', gmtime())}-{secrets.token_hex(2)}"
+
+_log_fields: ContextVar[dict] = ContextVar("log_fields", default={})
+_log_queue: Queue = Queue()
+_log_writer_pid = None
+_log_lock = threading.Lock()
+
+
+@contextmanager
+def log_context(**fields):
+    """Attach fields (eg. episode, stage) to every record logged inside the block, per thread / async task."""
+    token = _log_fields.set({**_log_fields.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_fields.reset(token)
+
+
+def _level_of(content: str) -> str:
+    if content.startswith("[ERR]") or content.startswith("Error"):
+        return "error"
+    return "info"
+
+
+def log(content: any, newlines=1, level: str = None, **fields) -> None:
+    if level is not None and level not in LOG_LEVELS:
+        raise ValueError(f"Unknown log level '{level}', expected one of {', '.join(LOG_LEVELS)}")
+    text = str(content)
+    record = {"ts": round(time(), 3), "level": level or _level_of(text), "run": RUN_ID, **_log_fields.get(), **fields, "msg": text}
+    _ensure_log_writer()
+    _log_queue.put((newlines, record))
+
+
+def flush_logs() -> None:
+    """Block until everything logged so far is written, eg. before a worker process exits."""
+    if _log_writer_pid == os.getpid():
+        _log_queue.join()
+
+
+def _ensure_log_writer() -> None:
+    global _log_writer_pid, _log_queue
+    if _log_writer_pid == os.getpid():
+        return
+    with _log_lock:
+        if _log_writer_pid == os.getpid():
+            return
+        if _log_writer_pid is not None:
+            # forked child: the parent's writer thread didn't come along
+            _log_queue = Queue()
+        _log_writer_pid = os.getpid()
+        threading.Thread(target=_write_logs, args=(_log_queue,), name="log-writer", daemon=True).start()
+        atexit.register(flush_logs)
+
+
+def _write_logs(queue: Queue, max_batch=256, interval=0.2) -> None:
+    console_level = LOG_LEVELS.get(LOG_LEVEL, 20)
+    while True:
+        batch = [queue.get()]
+        try:
+            while len(batch) < max_batch:
+                batch.append(queue.get(timeout=0 if len(batch) > 1 else interval))
+        except Empty:
+            pass
+        try:
+            with open(FILE_LOG, 'a') as txt, open(FILE_LOG_JSONL, 'a') as jsonl:
+                for newlines, record in batch:
+                    if LOG_LEVELS[record["level"]] >= console_level:
+                        print(record["msg"])
+                    txt.write('\n' * newlines)
+                    txt.write(f"{strftime('%H:%M:%S', gmtime(record['ts']))}  {record['msg']}")
+                    jsonl.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except Exception as e:
+            print(f"[ERR] log writer: {e}")
+        finally:
+            for _ in batch:
+                queue.task_done()
+
 
 def timestamp_date() -> str:
     return strftime("%Y-%m-%d %H:%M:%S", gmtime())
@@ -53,38 +175,31 @@ def slugify(input:str, replacer="-") -> str:
 def boot_ollama():
     subprocess.run("ollama list", shell=True, capture_output=True)
 
-class timer:
-    _timers = {}
-
-    @classmethod
-    def start(cls, name: str):
-        """Start a timer with the given name."""
-        cls._timers[name] = time()
-
-    @classmethod
-    def end(cls, name: str) -> str:
-        """End the timer with the given name and return the elapsed time as a string."""
-        if name not in cls._timers:
-            raise RuntimeError(f"Timer '{name}' has not been started.")
-        
-        start_time = cls._timers.pop(name)
-        elapsed = time() - start_time
-        return f"{elapsed:.2f}sec"
-
-    @classmethod
-    def get(cls, name: str) -> str:
-        start_time = cls._timers[name]
-        elapsed = time() - start_time
-        if elapsed > 120:
-            return f"{(elapsed/60):.2f}min"
-        return f"{elapsed:.2f}sec"
+# media files are hashed from their size and a few samples, hashing every byte of a multi GB video takes seconds
+HASH_SAMPLES = 16
+HASH_SAMPLE_BYTES = 1024 * 1024
+
+def content_hash(path: str) -> str:
+    import hashlib
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        for k in range(HASH_SAMPLES):
+            f.seek(max(0, (size - HASH_SAMPLE_BYTES) * k // max(1, HASH_SAMPLES - 1)))
+            digest.update(f.read(HASH_SAMPLE_BYTES))
+    return digest.hexdigest()[:16]
+
+def format_duration(seconds: float) -> str:
+    if seconds > 120:
+        return f"{(seconds/60):.2f}min"
+    return f"{seconds:.2f}sec"
 
 
     
 # ------------------------------- #
 # ----------- Typing ------------ #
 # ------------------------------- #
-from typing import TypedDict, List
+from typing import TypedDict, NotRequired, List, Optional, Tuple, Callable, Iterable, Iterator
 
 
 class Word(TypedDict):
@@ -92,22 +207,41 @@ class Word(TypedDict):
     start: float
     end: float
     score: float
+    # set once the transcript is diarized
+    speaker: NotRequired[str]
 
 class Segment(TypedDict):
     start: float
     end: float
     text: str
     words: List[Word]
+    speaker: NotRequired[str]
 
 class Transcript(TypedDict):
     segments: List[Segment]
     word_segments: List[Word]
 
+class SpeakerTurn(TypedDict):
+    start: float
+    end: float
+    speaker: str
+
 # a list of multiple parts of a single clip
 Clip = List[Segment]
 AllClips = List[Clip]
 PostQueryResults = List[List[Word]]
 
+# video keyframe times + the stream params needed to re-encode matching edges, see `fn_keyframes`
+class KeyframeIndex(TypedDict):
+    keyframes: List[float]
+    codec: str
+    pix_fmt: str
+    # ffprobe stream fields of the first video / audio stream, see `fn_keyframes.build_keyframe_index`
+    video: dict
+    audio: dict
+    size: int
+    mtime: float
+
 
 LLM_OPTIONS={
     "best_b": {
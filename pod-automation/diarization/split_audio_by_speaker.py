@@ -1,30 +1,100 @@
 import sys
 import json
-from pydub import AudioSegment
+import wave
+import argparse
+import subprocess
+import tempfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
-input_audio = sys.argv[1]
-segments_json = sys.argv[2]
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "clips"))
+from audio_cache import load_audio, SAMPLE_RATE
 
-audio = AudioSegment.from_file(input_audio)
+# frames converted per step when exporting float samples
+EXPORT_BLOCK = SAMPLE_RATE * 60
 
-# Prepare audio per speaker
-speaker_tracks = {}
 
-with open(segments_json) as f:
-    data = json.load(f)
+def probe_audio(input_audio: str) -> tuple:
+    """Sample rate and channel count of the first audio stream."""
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=sample_rate,channels", "-of", "json", input_audio]
+    stream = json.loads(subprocess.run(cmd, capture_output=True, text=True, check=True).stdout)["streams"][0]
+    return int(stream["sample_rate"]), int(stream["channels"])
 
-for segment in data["segments"]:
-    start_ms = int(segment["start"] * 1000)
-    end_ms = int(segment["end"] * 1000)
-    speaker = segment["speaker"]
 
-    if speaker not in speaker_tracks:
-        speaker_tracks[speaker] = AudioSegment.silent(duration=0)
+def decode_pcm(input_audio: str, tmp: str) -> tuple:
+    """
+    16-bit samples at the source rate and channels, shaped (frames, channels). ffmpeg writes them to `tmp` and they
+    are memory-mapped from there, exported as they are without converting them.
+    """
+    sample_rate, channels = probe_audio(input_audio)
+    raw = f"{tmp}/audio.s16le"
+    cmd = ["ffmpeg", "-nostdin", "-i", input_audio, "-f", "s16le", "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-ac", str(channels), "-y", raw]
+    subprocess.run(cmd, capture_output=True, check=True)
+    pcm = np.memmap(raw, dtype="<i2", mode="r") if Path(raw).stat().st_size else np.zeros(0, dtype="<i2")
+    return pcm.reshape(-1, channels), sample_rate
 
-    speaker_tracks[speaker] += audio[start_ms:end_ms]
 
-# Export each speaker's audio
-for speaker, track in speaker_tracks.items():
-    output_name = f"{speaker.lower().replace(' ', '_')}.wav"
-    track.export(output_name, format="wav")
-    print(f"Exported: {output_name}")
+def split_by_speaker(audio: np.ndarray, segments: list, sample_rate: int) -> dict:
+    """Per speaker, the slices of `audio` its segments cover in time order. Slices are views, nothing is copied."""
+    starts = np.array([seg["start"] for seg in segments], dtype=np.float64)
+    ends = np.array([seg["end"] for seg in segments], dtype=np.float64)
+    speakers, speaker_ids = np.unique([seg["speaker"] for seg in segments], return_inverse=True)
+
+    # segment bounds in frames, all at once
+    lo = np.clip(np.rint(starts * sample_rate).astype(np.int64), 0, len(audio))
+    hi = np.clip(np.rint(ends * sample_rate).astype(np.int64), 0, len(audio))
+    keep = np.flatnonzero(hi > lo)
+
+    # one stable sort groups the segment indices per speaker, in time order within each group
+    order = keep[np.argsort(speaker_ids[keep], kind="stable")]
+    groups = np.split(order, np.cumsum(np.bincount(speaker_ids[keep], minlength=len(speakers)))[:-1])
+
+    return {
+        str(speaker): [audio[a:b] for a, b in zip(lo[group].tolist(), hi[group].tolist())]
+        for speaker, group in zip(speakers, groups)
+    }
+
+
+def export_wav(path: str, parts: list, sample_rate: int, channels: int) -> str:
+    """16-bit wav of `parts` back to back. int16 parts are written as they are, float ones converted a block at a time."""
+    with wave.open(path, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        for part in parts:
+            if part.dtype == np.int16:
+                f.writeframes(np.ascontiguousarray(part))
+                continue
+            for i in range(0, len(part), EXPORT_BLOCK):
+                f.writeframes((part[i:i + EXPORT_BLOCK] * 32767).clip(-32768, 32767).astype("<i2"))
+    return path
+
+
+def main(input_audio: str, segments_json: str, downsample=False):
+    with open(segments_json) as f:
+        data = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if downsample:
+            # the samples whisperx_pipeline.py already decoded, 16kHz mono
+            audio, sample_rate = load_audio(input_audio)[:, None], SAMPLE_RATE
+        else:
+            audio, sample_rate = decode_pcm(input_audio, tmp)
+
+        tracks = split_by_speaker(audio, data["segments"], sample_rate)
+
+        # Export each speaker's audio, numpy and file writes release the GIL so threads run them in parallel
+        with ThreadPoolExecutor() as pool:
+            outputs = pool.map(lambda item: export_wav(f"{item[0].lower().replace(' ', '_')}.wav", item[1], sample_rate, audio.shape[1]), tracks.items())
+            for output_name in outputs:
+                print(f"Exported: {output_name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the audio of every speaker in diarization_segments.json to <speaker>.wav")
+    parser.add_argument("input_audio")
+    parser.add_argument("segments_json")
+    parser.add_argument("--16k", dest="downsample", action="store_true", help="export 16kHz mono from the shared audio cache instead of the source quality")
+    args = parser.parse_args()
+    main(args.input_audio, args.segments_json, args.downsample)
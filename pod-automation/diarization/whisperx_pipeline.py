@@ -1,41 +1,47 @@
-import whisperx
 import sys
-import torch
 import json
+from pathlib import Path
 
-audio_file = sys.argv[1]
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "clips"))
+from fn_transcribe import transcribe_with_whisperx
+from fn_diarize import start_diarization, finish_diarization
+from utils import flush_logs
 
 device = "cpu"  # Use "mps" for Metal acceleration on M2 Macs
-batch_size = 16
-compute_type = "int8"
-
-print("Loading Whisper model...")
-model = whisperx.load_model("large-v2", device, compute_type=compute_type)
-
-print("Transcribing...")
-transcription = model.transcribe(audio_file, batch_size=batch_size)
-
-print("Aligning timestamps...")
-model_a, metadata = whisperx.load_align_model(language_code=transcription["language"], device=device)
-aligned = whisperx.align(transcription["segments"], model_a, metadata, audio_file, device)
-
-print("Running diarization...")
-diarize_model = whisperx.DiarizationPipeline(use_auth_token=True, device=device)
-diarize_segments = diarize_model(audio_file)
-
-# Combine speaker labels with segments
-print("Combining diarization and transcript...")
-final_result = whisperx.assign_word_speakers(diarize_segments, aligned)
-
-# Extract simplified segments with speaker and timestamp
-output_segments = []
-for seg in final_result["segments"]:
-    output_segments.append({
-        "start": seg["start"],
-        "end": seg["end"],
-        "speaker": seg.get("speaker", "Speaker_1")
-    })
-
-# Save
-with open("diarization_segments.json", "w") as f:
-    json.dump({"segments": output_segments}, f, indent=2)
+
+
+def main(audio_file: str):
+    guest_name = Path(audio_file).stem
+
+    # Diarization runs in its own process while this one transcribes and aligns
+    print("Running diarization...")
+    diarization = start_diarization(audio_file, device=device)
+
+    # Reuses the clips pipeline's cached (aligned) transcript, only transcribes if there is none yet
+    print("Transcribing...")
+    transcribe_with_whisperx(audio_file, guest_name, use_cache=True)
+
+    # Combine speaker labels with segments
+    print("Combining diarization and transcript...")
+    final_result = finish_diarization(diarization, guest_name)
+    if final_result is None:
+        sys.exit("Diarization failed")
+
+    # Extract simplified segments with speaker and timestamp
+    output_segments = []
+    for seg in final_result["segments"]:
+        output_segments.append({
+            "start": seg["start"],
+            "end": seg["end"],
+            "speaker": seg.get("speaker", "Speaker_1")
+        })
+
+    # Save
+    with open("diarization_segments.json", "w") as f:
+        json.dump({"segments": output_segments}, f, indent=2)
+    flush_logs()
+
+
+# the diarization process is spawned, it imports this file again and must not rerun the script
+if __name__ == "__main__":
+    main(sys.argv[1])